@@ -1,8 +1,14 @@
+import asyncio
 import logging
 from aiogram import executor
+from aiohttp import web
+from config import WEBHOOK_ENABLED, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_MAX_CONNECTIONS, \
+    WEBAPP_HOST, WEBAPP_PORT, METRICS_ENABLED, METRICS_HOST, METRICS_PORT, WORKERS, WORKER_BASE_PORT
 from loader import dp, bot
 import handlers
 import core
+from core import workers
+from core.webhook import WebhookHandler
 import time
 
 BOT_START_TIME = time.time()
@@ -12,7 +18,87 @@ logging.basicConfig(
 )
 
 async def on_startup(dp):
-    await core.db.init_db()
+    if METRICS_ENABLED:
+        await core.metrics.start_server(METRICS_HOST, METRICS_PORT + workers.index)
+    await core.db.on_startup()
+    await core.broadcast.resume_broadcasts(bot)
+    core.broadcast.start_watching(bot)
+    # Shared tables: one worker is enough to sweep them, more would send outbox messages twice
+    if workers.index == 0:
+        dp.storage.start_eviction()
+        core.outbox.start_outbox(bot)
+
+async def on_startup_webhook(dp):
+    await on_startup(dp)
+    await bot.set_webhook(
+        WEBHOOK_HOST + WEBHOOK_PATH,
+        secret_token=workers.webhook_secret,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+
+async def on_shutdown(dp):
+    await core.broadcast.stop_broadcasts()
+    await core.catalog_io.stop_uploads()
+    await core.outbox.stop_outbox()
+    await core.db.on_shutdown()
+    await core.metrics.stop_server()
+
+# Worker i of a multi-process setup: takes updates from the front process over local HTTP
+def run_worker():
+    runner = executor.Executor(dp)
+    runner.on_startup(on_startup)
+    runner.on_shutdown(on_shutdown)
+    runner.start_webhook(WEBHOOK_PATH, request_handler=WebhookHandler,
+                         host="127.0.0.1", port=WORKER_BASE_PORT + workers.index)
+
+def run_front():
+    front = workers.Front(WORKERS)
+
+    async def start_front(app):
+        # Migrate once here, before workers open the database
+        await core.db.init_db()
+        await front.start()
+
+    async def stop_front(app):
+        await front.stop()
+        await (await bot.get_session()).close()
+
+    if WEBHOOK_ENABLED:
+        async def set_webhook(app):
+            await bot.set_webhook(
+                WEBHOOK_HOST + WEBHOOK_PATH,
+                secret_token=workers.webhook_secret,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, front.handle_webhook)
+        app.on_startup.extend((start_front, set_webhook))
+        app.on_cleanup.append(stop_front)
+        web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT)
+    else:
+        async def poll():
+            await start_front(None)
+            try:
+                await front.poll(bot)
+            finally:
+                await stop_front(None)
+
+        try:
+            asyncio.run(poll())
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
\ No newline at end of file
+    if workers.is_worker:
+        run_worker()
+    elif WORKERS > 1:
+        run_front()
+    elif WEBHOOK_ENABLED:
+        # Updates queued while the bot was down are still delivered
+        runner = executor.Executor(dp)
+        runner.on_startup(on_startup_webhook)
+        runner.on_shutdown(on_shutdown)
+        runner.start_webhook(WEBHOOK_PATH, request_handler=WebhookHandler, host=WEBAPP_HOST, port=WEBAPP_PORT)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -0,0 +1,71 @@
+# User-facing reply latency while a broadcast is being sent, and the busiest second of outgoing
+# traffic, for three ways of rate limiting: the broadcast limiting only itself, one shared queue
+# for everything, and core.ratelimit.Scheduler with priority classes
+# Run from the repo root: python -m bench.api_scheduler [broadcast size] [replies per second]
+import asyncio
+import collections
+import random
+import statistics
+import sys
+import time
+
+from core import ratelimit
+
+BROADCAST = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+REPLY_RATE = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+SENDERS = 10  # as in core.broadcast
+
+
+async def run(label, scheduler, reply_level, bulk_level):
+    sent_at = []
+    latencies = []
+
+    async def send(chat_id, level):
+        if level is not None:
+            await scheduler.acquire(chat_id, level)
+        sent_at.append(time.monotonic())
+
+    async def broadcast(queue):
+        while queue:
+            await send(queue.popleft(), bulk_level)
+
+    async def replies(stop):
+        rng = random.Random(1)
+        tasks = []
+        while not stop.is_set():
+            await asyncio.sleep(rng.expovariate(REPLY_RATE))
+            tasks.append(asyncio.create_task(reply(1_000_000 + rng.randrange(10 ** 6))))
+        await asyncio.gather(*tasks)
+
+    async def reply(chat_id):
+        started = time.monotonic()
+        await send(chat_id, reply_level)
+        latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    queue, stop = collections.deque(range(1, BROADCAST + 1)), asyncio.Event()
+    users = asyncio.create_task(replies(stop))
+    await asyncio.gather(*(broadcast(queue) for _ in range(SENDERS)))
+    elapsed = time.monotonic() - started
+    stop.set()
+    await users
+
+    per_second = collections.Counter(int(at - started) for at in sent_at)
+    latencies.sort()
+    print(f"{label:<10} broadcast {elapsed:5.1f}s   reply p50 {statistics.median(latencies) * 1e3:6.0f} ms"
+          f"   p99 {latencies[int(len(latencies) * 0.99)] * 1e3:6.0f} ms"
+          f"   busiest second {max(per_second.values())} msgs"
+          f" (at most {scheduler.rate + scheduler.burst:g}: the rate plus the burst)")
+
+
+async def main():
+    print(f"broadcast to {BROADCAST} users, {REPLY_RATE:g} replies/s from other users")
+    # Before: the broadcast had a bucket of its own and replies went out uncounted
+    await run("separate", ratelimit.Scheduler(), None, ratelimit.BULK)
+    # Everything in one queue, first come first served
+    await run("fifo", ratelimit.Scheduler(), ratelimit.BULK, ratelimit.BULK)
+    await run("priority", ratelimit.Scheduler(), ratelimit.INTERACTIVE, ratelimit.BULK)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
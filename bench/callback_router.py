@@ -0,0 +1,80 @@
+# Cost of finding the handler for a callback query: aiogram filters tried one by one versus
+# core.callbacks.router, with the same number of registered handlers in both
+# Run from the repo root: python -m bench.callback_router [handlers] [updates]
+import asyncio
+import sys
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from core.callbacks import Callback, CallbackRouter
+
+HANDLERS = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+UPDATES = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+calls = 0
+
+
+async def handled(call, **fields):
+    global calls
+    calls += 1
+
+
+def filtered(prefix):
+    # What handlers/products.py did: a startswith filter, then the id split out of the data again
+    async def handler(call):
+        await handled(call, product_id=int(call.data.split("_")[-1]))
+    return (lambda c: c.data.startswith(prefix + "_")), handler
+
+
+def update(update_id, data):
+    return types.Update(**{
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "1", "data": data,
+            "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "page"},
+        },
+    })
+
+
+async def run(label, dp, updates):
+    global calls
+    calls = 0
+    started = time.perf_counter()
+    for item in updates:
+        await dp.process_update(item)
+    elapsed = time.perf_counter() - started
+    assert calls == len(updates), calls
+    print(f"{label:<8} {elapsed / len(updates) * 1e6:7.1f} µs/update")
+
+
+async def main():
+    bot = Bot("123456:bench-token-not-used-for-requests")
+    prefixes = [f"action{i}" for i in range(HANDLERS)]
+
+    linear = Dispatcher(bot, storage=MemoryStorage())
+    for prefix in prefixes:
+        callback_filter, handler = filtered(prefix)
+        linear.register_callback_query_handler(handler, callback_filter)
+
+    routed = Dispatcher(bot, storage=MemoryStorage())
+    router = CallbackRouter()
+    for prefix in prefixes:
+        router.register(handled, Callback(prefix, ("product_id", int)))
+    router.setup(routed)
+
+    # Clicks spread evenly over the handlers, so the filters try half of them on average
+    updates = [update(i, f"{prefixes[i % HANDLERS]}_{i}") for i in range(UPDATES)]
+    print(f"{HANDLERS} handlers, {UPDATES} callback queries")
+    await run("filters", linear, updates)
+    await run("router", routed, updates)
+    started = time.perf_counter()
+    for item in updates:
+        router.resolve(item.callback_query.data)
+    print(f"{'resolve':<8} {(time.perf_counter() - started) / len(updates) * 1e6:7.1f} µs/update (trie lookup alone)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
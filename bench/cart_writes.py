@@ -0,0 +1,59 @@
+# Add-to-cart throughput with a transaction per tap versus the group-committed queue in core.db
+# Run from the repo root: python -m bench.cart_writes [users] [taps per user] [synchronous]
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from bench.seed import seed
+from core import db
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+TAPS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+# NORMAL is what core.db runs with; FULL shows a disk that fsyncs every commit
+SYNCHRONOUS = sys.argv[3] if len(sys.argv) > 3 else "NORMAL"
+
+
+# What add_to_cart did before the queue: its own transaction and commit
+async def per_call(user_id, product_id):
+    async with db.pool.transaction() as conn:
+        await conn.execute(db.ADD_TO_CART_SQL, (user_id, product_id, 1))
+    db._invalidate_cart(user_id)
+
+
+async def run(label, add, phones):
+    latencies = []
+
+    async def user(user_id):
+        for tap in range(TAPS):
+            started = time.perf_counter()
+            await add(user_id, phones[(user_id + tap) % len(phones)])
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(1, USERS + 1)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"{label:<10} {len(latencies) / elapsed:8.0f} writes/s   p50 {statistics.median(latencies) * 1e3:6.1f} ms"
+          f"   p99 {latencies[int(len(latencies) * 0.99)] * 1e3:6.1f} ms")
+    async with db.pool.connection() as conn:
+        await conn.execute("DELETE FROM cart")
+        await conn.commit()
+
+
+async def main():
+    db.PRAGMAS = db.PRAGMAS + (f"PRAGMA synchronous = {SYNCHRONOUS}",)
+    with tempfile.TemporaryDirectory() as tmp:
+        phones = await seed(os.path.join(tmp, "bench.db"), USERS, 1000)
+        await db.pool.open()
+        await db.reload_catalog()
+        print(f"{USERS} users x {TAPS} taps, synchronous = {SYNCHRONOUS}")
+        await run("per call", per_call, phones)
+        await run("queued", db.add_to_cart, phones)
+        await db.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+# Bulk import of a generated catalog file and export of the result
+# Run from the repo root: python -m bench.catalog_import [products] [csv|json|jsonl]
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import time
+
+from bench import fakeapi, seed
+
+PRODUCTS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+FORMAT = sys.argv[2] if len(sys.argv) > 2 else "csv"
+
+
+def write_document(path, count):
+    rows = [dict(zip(("name", "description", "price", "category", "image"), row))
+            for row in seed.products(count, random.Random(1))]
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        if FORMAT == "csv":
+            writer = csv.DictWriter(file, fieldnames=rows[0])
+            writer.writeheader()
+            writer.writerows(rows)
+        elif FORMAT == "json":
+            json.dump(rows, file, ensure_ascii=False)
+        else:
+            file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+async def main():
+    tmp = fakeapi.install(database=None)
+    from core import db, catalog_io
+
+    await db.on_startup()
+    document = os.path.join(tmp, f"catalog.{FORMAT}")
+    write_document(document, PRODUCTS)
+
+    started = time.perf_counter()
+    report = await catalog_io.import_catalog(document)
+    elapsed = time.perf_counter() - started
+    print(f"import: {report.added} products ({report.rejected} rejected) in {elapsed:.2f}s "
+          f"({report.added / elapsed:.0f}/s)")
+
+    started = time.perf_counter()
+    path = await catalog_io.export_catalog("csv")
+    print(f"export: {os.path.getsize(path) / 1e6:.1f} MB in {time.perf_counter() - started:.2f}s")
+    os.remove(path)
+    await db.on_shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+# Memory of the catalog snapshot built from raw rows versus core.models.Product objects,
+# and the cost of finding one product by id with a scan versus the snapshot's index
+# Run from the repo root: python -m bench.catalog_memory [products] [lookups]
+import asyncio
+import collections
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+from bench.seed import products as fake_products
+from core import db
+
+PRODUCTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+LOOKUPS = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+
+def fetch_rows():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, description TEXT, "
+                 "price REAL, category TEXT, image TEXT)")
+    conn.executemany("INSERT INTO products (name, description, price, category, image) VALUES (?, ?, ?, ?, ?)",
+                     fake_products(PRODUCTS, random.Random(1)))
+    return conn, "SELECT id, name, description, price, category, image FROM products ORDER BY id"
+
+
+# The layout reload_catalog used to keep: the fetched tuples, grouped per category and indexed by id
+def rows_snapshot(rows):
+    categories = collections.defaultdict(list)
+    for row in rows:
+        categories[row[4]].append(row)
+    return db.CatalogSnapshot(1, {name: tuple(items) for name, items in categories.items()},
+                              {row[0]: row for row in rows})
+
+
+def measure(label, build, conn, query):
+    tracemalloc.start()
+    snapshot = build(conn.execute(query).fetchall())
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{label:<10} {size / 2 ** 20:7.1f} MiB  {size / PRODUCTS:6.0f} B/product")
+    return snapshot
+
+
+def timed(label, lookup, ids):
+    started = time.perf_counter()
+    for product_id in ids:
+        lookup(product_id)
+    print(f"{label:<10} {(time.perf_counter() - started) / len(ids) * 1e6:9.2f} µs/lookup")
+
+
+def main():
+    conn, query = fetch_rows()
+    rows = measure("rows", rows_snapshot, conn, query)
+    db._catalog = measure("products", lambda fetched: db.build_catalog(1, fetched), conn, query)
+
+    ids = [random.randint(1, PRODUCTS) for _ in range(LOOKUPS)]
+    # What add_to_cart_handler did: both categories concatenated and scanned
+    timed("scan", lambda product_id: next(
+        p for p in rows.categories["Smartphones"] + rows.categories["Accessories"] if p[0] == product_id
+    ), ids[:max(1, LOOKUPS // 100)])
+    asyncio.run(lookups(ids))
+
+
+async def lookups(ids):
+    started = time.perf_counter()
+    for product_id in ids:
+        await db.get_product(product_id)
+    print(f"{'get_product':<10} {(time.perf_counter() - started) / len(ids) * 1e6:9.2f} µs/lookup")
+    started = time.perf_counter()
+    await db.get_products(ids)
+    print(f"{'get_products':<10} {(time.perf_counter() - started) / len(ids) * 1e6:9.2f} µs/id, {len(ids)} ids at once")
+
+
+if __name__ == "__main__":
+    main()
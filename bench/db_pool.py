@@ -0,0 +1,56 @@
+# Queries/sec of connect-per-call versus the shared pool in core.db
+# Run from the repo root: python -m bench.db_pool
+import asyncio
+import os
+import tempfile
+import time
+
+import aiosqlite
+
+from core import db
+
+QUERIES = 2000
+CONCURRENCY = 20
+
+
+async def connect_per_call():
+    async with aiosqlite.connect(db.DB_PATH) as conn:
+        cursor = await conn.execute("SELECT * FROM products WHERE category = ?", ('Smartphones',))
+        return await cursor.fetchall()
+
+
+async def pooled():
+    async with db.pool.connection() as conn:
+        cursor = await conn.execute("SELECT * FROM products WHERE category = ?", ('Smartphones',))
+        return await cursor.fetchall()
+
+
+async def run(query):
+    async def worker(n):
+        for _ in range(n):
+            await query()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(QUERIES // CONCURRENCY) for _ in range(CONCURRENCY)))
+    return QUERIES / (time.perf_counter() - started)
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = db.pool.path = os.path.join(tmp, "bench.db")
+        await db.init_db()
+        for i in range(200):
+            await db.add_product(f"Phone {i}", "bench", 100 + i, "Smartphones", "file_id")
+        await db.pool.close()
+
+        before = await run(connect_per_call)
+        await db.pool.open()
+        after = await run(pooled)
+        await db.pool.close()
+
+    print(f"connect per call: {before:8.0f} queries/sec")
+    print(f"pooled:           {after:8.0f} queries/sec ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+# End-to-end run of the real dispatcher against the fake Bot API on a synthetic database:
+# browse -> search -> add to cart -> checkout for many users, then an admin broadcast to all of them
+# Run from the repo root: python -m bench.e2e [users] [products] [active users] [concurrency]
+import asyncio
+import itertools
+import os
+import sys
+import time
+
+import aiosqlite
+
+from bench import fakeapi, seed
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+PRODUCTS = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+ACTIVE = int(sys.argv[3]) if len(sys.argv) > 3 else 1000  # users that go through the scripted flows
+CONCURRENCY = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+
+statements = itertools.count()
+
+
+# Counts statements sent by our code; FTS5 and triggers run more inside SQLite, those are not queries we issue
+def count_statements():
+    execute = aiosqlite.Connection._execute
+
+    async def counting(self, fn, *args, **kwargs):
+        if fn.__name__ in ("execute", "executemany", "executescript"):
+            next(statements)
+        return await execute(self, fn, *args, **kwargs)
+
+    aiosqlite.Connection._execute = counting
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def flows(phones):
+    first, second = phones[0], phones[1]
+    return {
+        "browse": lambda u: [
+            ("message", "/start"), ("callback", "products", False), ("callback", "category_phones"),
+            *(("callback", f"phone_next_{phone}") for phone in phones[:5]),
+            ("callback", f"phone_prev_{phones[5]}"),
+        ],
+        "search": lambda u: [
+            ("callback", "search", False), ("message", "galaxy"), ("button", "search_"),
+            ("button", "search_"),
+        ],
+        "cart": lambda u: [
+            ("callback", f"add_to_cart_{first}"), ("message", "2"),
+            ("callback", f"add_to_cart_{second}"), ("message", "1"),
+            ("callback", "view_cart", False),
+        ],
+        "checkout": lambda u: [
+            ("callback", "checkout", False), ("message", f"User {u}"), ("message", "+996 555 123 456"),
+        ],
+    }
+
+
+async def run_phase(dp, name, script, users, update_ids):
+    from aiogram import types
+
+    def build(user_id, step):
+        if step[0] == "message":
+            return fakeapi.message_update(next(update_ids), user_id, step[1])
+        if step[0] == "button":
+            # Presses the last matching button the bot sent this user, e.g. a search page with its token
+            data = [data for data in fakeapi.buttons.get(user_id, ()) if data and data.startswith(step[1])][-1]
+            return fakeapi.callback_update(next(update_ids), user_id, data)
+        return fakeapi.callback_update(next(update_ids), user_id, step[1], *step[2:])
+
+    latencies = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def session(user_id):
+        async with semaphore:
+            # One user's updates are processed in order, like the dispatcher does per chat
+            for step in script(user_id):
+                update = types.Update(**build(user_id, step))
+                started = time.perf_counter()
+                await asyncio.create_task(dp.process_update(update))
+                latencies.append(time.perf_counter() - started)
+
+    queries_before, calls_before = next(statements), len(fakeapi.calls)
+    started = time.perf_counter()
+    await asyncio.gather(*(session(user_id) for user_id in users))
+    elapsed = time.perf_counter() - started
+    queries = next(statements) - queries_before - 1
+
+    latencies.sort()
+    print(f"{name:<10} {len(latencies):>7} {len(latencies) / elapsed:>9.0f} "
+          f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} "
+          f"{percentile(latencies, 0.99) * 1000:>8.1f} {queries / len(latencies):>9.1f} "
+          f"{(len(fakeapi.calls) - calls_before) / len(latencies):>6.1f}")
+
+
+async def run_broadcast(dp, update_ids):
+    import config
+    from aiogram import types
+    from core import broadcast, db
+
+    admin = config.ADMINS[0]
+    for step in (("message", "📢 Отправить сообщение"), ("message", "Новости магазина"),
+                 ("callback", "confirm_broadcast", False)):
+        data = fakeapi.message_update(next(update_ids), admin, step[1]) if step[0] == "message" \
+            else fakeapi.callback_update(next(update_ids), admin, step[1], step[2])
+        await asyncio.create_task(dp.process_update(types.Update(**data)))
+
+    broadcast_ids = list(broadcast._running)
+    queries_before, calls_before = next(statements), fakeapi.calls.count("copyMessage")
+    started = time.perf_counter()
+    await asyncio.gather(*broadcast._running.values())
+    elapsed = time.perf_counter() - started
+    sent = fakeapi.calls.count("copyMessage") - calls_before
+    queries = next(statements) - queries_before - 1
+    counts = [await db.get_broadcast_counts(broadcast_id) for broadcast_id in broadcast_ids]
+    print(f"broadcast: {sent} messages in {elapsed:.1f}s ({sent / elapsed:.0f}/s), "
+          f"{queries / max(sent, 1):.2f} statements per message {counts}")
+
+
+async def main():
+    tmp = fakeapi.install(database=None)
+    path = os.path.join(tmp, "bot.db")
+    started = time.perf_counter()
+    phones = await seed.seed(path, USERS, PRODUCTS)
+    print(f"seeded {USERS} users and {PRODUCTS} products in {time.perf_counter() - started:.1f}s")
+
+    from aiogram import Bot, Dispatcher
+    from loader import dp, bot
+    import handlers  # noqa: F401 registers handlers
+    import app as bot_app
+
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await bot_app.on_startup(dp)
+    count_statements()
+
+    update_ids = itertools.count(1)
+    # Active users are the newest ones so /start hits existing rows, as it does for returning users
+    users = range(USERS - ACTIVE + 1, USERS + 1)
+    print(f"{'phase':<10} {'updates':>7} {'upd/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'sql/upd':>9} {'api/upd':>6}")
+    for name, script in flows(phones).items():
+        await run_phase(dp, name, script, users, update_ids)
+    await run_broadcast(dp, update_ids)
+
+    await bot_app.on_shutdown(dp)
+    await (await bot.get_session()).close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
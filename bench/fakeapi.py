@@ -0,0 +1,94 @@
+# Shared setup for the offline benchmarks: a throwaway copy of the database and a stand-in Bot API
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+from aiogram.bot import api
+
+BOT_ID = 123456
+_message_ids = itertools.count(1000)
+calls = []
+buttons = {}  # chat id -> callback data of the last inline keyboard sent there
+
+
+def _remember_buttons(data):
+    markup = data.get("reply_markup")
+    if isinstance(markup, str) and "inline_keyboard" in markup:
+        buttons[int(data["chat_id"])] = [
+            button.get("callback_data") for row in json.loads(markup)["inline_keyboard"] for button in row
+        ]
+
+
+async def fake_make_request(session, server, token, method, data=None, files=None, **kwargs):
+    calls.append(method)
+    data = data or {}
+    if "chat_id" in data:
+        _remember_buttons(data)
+    if method == "getMe":
+        return {"id": BOT_ID, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+    if method.startswith("send") or method == "copyMessage":
+        message = {
+            "message_id": next(_message_ids),
+            "date": 0,
+            "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+        }
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": f"photo-{message['message_id']}", "file_unique_id": "u",
+                                 "width": 1, "height": 1}]
+        return message
+    if method.startswith("editMessage") and "message_id" in data:
+        # Like Telegram: the edited message comes back, here with just enough of it for the handlers
+        message = {"message_id": int(data["message_id"]), "date": 0,
+                   "chat": {"id": int(data.get("chat_id", 0)), "type": "private"}}
+        if method == "editMessageMedia":
+            message["photo"] = [{"file_id": "photo", "file_unique_id": "u", "width": 1, "height": 1}]
+        elif method == "editMessageText":
+            message["text"] = data.get("text", "")
+        return message
+    return True
+
+
+# Must run before loader is imported: points core.db at a temp copy and swaps the HTTP layer.
+# Tests pass path and monkeypatch.setattr so every swap is undone after them.
+def install(database="db/bot.db", path=None, setattr=setattr):
+    import config
+    setattr(config, "BOT_TOKEN", f"{BOT_ID}:bench-token")
+    setattr(config, "METRICS_ENABLED", False)
+    setattr(api, "make_request", fake_make_request)
+
+    from core import db, ratelimit
+    # Measure our side only: the stand-in API has no flood limits to respect
+    setattr(ratelimit, "scheduler", ratelimit.Scheduler(10 ** 9, 10 ** 9, 10 ** 9, 10 ** 9, 10 ** 9))
+    tmp = os.path.dirname(path) if path else tempfile.mkdtemp()
+    setattr(db, "DB_PATH", path or os.path.join(tmp, "bot.db"))
+    setattr(db.pool, "path", db.DB_PATH)
+    if database and os.path.exists(database):
+        shutil.copy(database, db.DB_PATH)
+    return tmp
+
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+
+def message_update(update_id, user_id, text):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": text,
+        "chat": {"id": user_id, "type": "private"}, "from": user(user_id),
+    }}
+
+
+def callback_update(update_id, user_id, data, photo=True):
+    message = {"message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"},
+               "from": {"id": BOT_ID, "is_bot": True, "first_name": "bench"}}
+    if photo:
+        message["photo"] = [{"file_id": "photo", "file_unique_id": "u", "width": 1, "height": 1}]
+        message["caption"] = "caption"
+    else:
+        message["text"] = "text"
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": "bench", "data": data,
+        "from": user(user_id), "message": message,
+    }}
@@ -0,0 +1,50 @@
+# Resident memory of MemoryStorage versus core.storage.SQLiteStorage with 100k users parked mid-conversation
+# Run from the repo root: python -m bench.fsm_memory [users]
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+
+def rss_mb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+
+async def fill(storage):
+    for user in range(1, USERS + 1):
+        await storage.set_state(chat=user, user=user, state="QuantityState:waiting_for_quantity")
+        await storage.update_data(chat=user, user=user, product_id=user % 1000, product_name="Чехол для iPhone 13 pro")
+
+
+def measure(backend, tmp, results):
+    from core import db
+    from core.storage import SQLiteStorage
+    from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+    async def main():
+        db.DB_PATH = db.pool.path = os.path.join(tmp, f"{backend}.db")
+        await db.on_startup()
+        storage = SQLiteStorage() if backend == "sqlite" else MemoryStorage()
+        before = rss_mb()
+        await fill(storage)
+        results[backend] = (before, rss_mb(), await storage.get_data(chat=USERS, user=USERS))
+        await db.on_shutdown()
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp, multiprocessing.Manager() as manager:
+        results = manager.dict()
+        for backend in ("memory", "sqlite"):
+            process = multiprocessing.Process(target=measure, args=(backend, tmp, results))
+            process.start()
+            process.join()
+        for backend, (before, after, sample) in results.items():
+            print(f"{backend:7} {USERS} users: RSS {before:6.1f} MB -> {after:6.1f} MB (+{after - before:.1f} MB)")
@@ -0,0 +1,53 @@
+# Per-click cost of building a product page: fresh caption and keyboard vs the render cache
+# Run from the repo root: python -m bench.render [products] [clicks]
+import random
+import sys
+import time
+
+from aiogram.types import InputMediaPhoto
+
+from core import db, render
+from core.models import Product
+
+PRODUCTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CLICKS = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+
+def uncached(product, has_prev, has_next):
+    media = InputMediaPhoto(media=product.image, caption=render.product_caption(product))
+    keyboard = render.product_keyboard(
+        product.id,
+        f"phone_prev_{product.id}" if has_prev else None,
+        f"phone_next_{product.id}" if has_next else None,
+    )
+    return media, keyboard
+
+
+def run(label, build, clicks):
+    started = time.perf_counter()
+    for product, has_prev, has_next in clicks:
+        media, keyboard = build(product, has_prev, has_next)
+        # aiogram serializes the markup on every request either way
+        keyboard.as_json()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {elapsed / len(clicks) * 1e6:7.1f} µs/click")
+
+
+def main():
+    db._catalog = db.CatalogSnapshot(1, {}, {})
+    products = [
+        Product(i, f"Smartphone {i}", "Описание " * 20, 10000 + i, "Smartphones", f"https://example.com/{i}.jpg")
+        for i in range(1, PRODUCTS + 1)
+    ]
+    clicks = []
+    for _ in range(CLICKS):
+        index = random.randrange(PRODUCTS)
+        clicks.append((products[index], index > 0, index < PRODUCTS - 1))
+
+    run("uncached", uncached, clicks)
+    run("cached", lambda *page: render.category_page("Smartphones", *page), clicks)
+    print(render.get_render_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Throughput of the multi-process mode for 1, 2, 4... workers, fed through the front process logic.
+# Scaling needs free cores: on an N-core box expect gains up to about N - 1 workers (the front needs one).
+# Run from the repo root: python -m bench.scaling [max workers] [users]
+import asyncio
+import itertools
+import os
+import sys
+import time
+
+from bench import fakeapi, seed
+
+MAX_WORKERS = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] != "worker" else os.cpu_count()
+USERS = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[1] != "worker" else 2000
+
+
+def worker(path):
+    fakeapi.install(database=None)
+    from core import db
+    db.DB_PATH = db.pool.path = path
+    import app
+    app.run_worker()
+
+
+def script(user_id, phones):
+    yield fakeapi.message_update(0, user_id, "/start")
+    yield fakeapi.callback_update(0, user_id, "products", photo=False)
+    yield fakeapi.callback_update(0, user_id, "category_phones")
+    for phone in phones[:5]:
+        yield fakeapi.callback_update(0, user_id, f"phone_next_{phone}")
+    yield fakeapi.callback_update(0, user_id, "search", photo=False)
+    yield fakeapi.message_update(0, user_id, "galaxy")
+    yield fakeapi.callback_update(0, user_id, f"add_to_cart_{phones[0]}")
+    yield fakeapi.message_update(0, user_id, "1")
+
+
+async def measure(path, phones, workers):
+    from core.workers import Front
+
+    front = Front(workers, command=(sys.executable, "-m", "bench.scaling", "worker", path))
+    await front.start()
+    update_ids = itertools.count(1)
+    processed = 0
+
+    async def session(user_id):
+        nonlocal processed
+        for update in script(user_id, phones):
+            update["update_id"] = next(update_ids)
+            await front.dispatch(update)
+            processed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(user_id) for user_id in range(1, USERS + 1)))
+    elapsed = time.perf_counter() - started
+    await front.stop()
+    return processed / elapsed
+
+
+async def main():
+    tmp = fakeapi.install(database=None)
+    path = os.path.join(tmp, "bot.db")
+    phones = await seed.seed(path, 100000, 10000)
+
+    baseline = None
+    workers = 1
+    print(f"{os.cpu_count()} CPUs, {USERS} users")
+    while workers <= MAX_WORKERS:
+        rate = await measure(path, phones, workers)
+        baseline = baseline or rate
+        print(f"{workers:>2} workers: {rate:7.0f} updates/sec ({rate / baseline:.2f}x)")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["worker"]:
+        worker(sys.argv[2])
+    else:
+        asyncio.run(main())
@@ -0,0 +1,59 @@
+# Synthetic catalog and user base for the benchmarks
+# Run from the repo root: python -m bench.seed path/to/bot.db [users] [products]
+import asyncio
+import datetime
+import random
+import sqlite3
+import sys
+
+BRANDS = ("Apple iPhone", "Samsung Galaxy", "Xiaomi Redmi", "Honor", "Realme", "Poco", "Google Pixel", "Nokia")
+ACCESSORIES = ("Чехол", "Наушники", "Зарядка", "Кабель", "Защитное стекло", "Повербанк", "Смарт-часы", "Колонка")
+
+
+def products(count, rng):
+    for i in range(count):
+        if i % 2:
+            name = f"{rng.choice(ACCESSORIES)} {rng.choice(BRANDS)} {i}"
+            category = "Accessories"
+        else:
+            name = f"{rng.choice(BRANDS)} {rng.randint(5, 16)} {rng.choice(('Pro', 'Max', 'Lite', 'Plus', ''))} {i}"
+            category = "Smartphones"
+        yield (name.replace("  ", " "), f"Описание товара {i}: " + "характеристики " * 10,
+               rng.randint(500, 150000), category, f"https://example.com/images/{i}.jpg")
+
+
+def users(count, rng):
+    now = datetime.datetime.utcnow()
+    for telegram_id in range(1, count + 1):
+        created = now - datetime.timedelta(seconds=rng.randint(0, 60 * 24 * 3600))
+        yield telegram_id, f"User {telegram_id}", f"user{telegram_id}", created.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Fills an empty database; the schema comes from core.db so the numbers match production
+async def seed(path, user_count=100000, product_count=10000, rng_seed=1):
+    from core import db
+    db.DB_PATH = db.pool.path = path
+    await db.init_db()
+
+    rng = random.Random(rng_seed)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO products (name, description, price, category, image) VALUES (?, ?, ?, ?, ?)",
+            products(product_count, rng)
+        )
+        conn.executemany(
+            "INSERT INTO users (telegram_id, name, username, created_at) VALUES (?, ?, ?, ?)",
+            users(user_count, rng)
+        )
+    phones = [row[0] for row in conn.execute("SELECT id FROM products WHERE category = 'Smartphones' ORDER BY id")]
+    conn.close()
+    return phones
+
+
+if __name__ == "__main__":
+    asyncio.run(seed(
+        sys.argv[1],
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 10000,
+    ))
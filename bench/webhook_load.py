@@ -0,0 +1,80 @@
+# Posts synthetic updates to the webhook endpoint and reports latency percentiles
+# Run from the repo root: python -m bench.webhook_load [users] [concurrency]
+import asyncio
+import itertools
+import statistics
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from bench import fakeapi
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+
+async def main():
+    fakeapi.install()
+    import config
+    from core import workers
+    from loader import dp
+    import handlers  # noqa: F401 registers handlers
+    import app as bot_app
+    from core.webhook import WebhookHandler
+
+    await bot_app.on_startup(dp)
+    web_app = web.Application()
+    web_app["BOT_DISPATCHER"] = dp
+    web_app.router.add_route("*", config.WEBHOOK_PATH, WebhookHandler)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}{config.WEBHOOK_PATH}"
+
+    update_ids = itertools.count(1)
+    latencies = []
+    headers = {"X-Telegram-Bot-Api-Secret-Token": workers.webhook_secret}
+
+    async def session_for(http, user_id):
+        # Each simulated user sends its updates in order, like Telegram does per chat
+        for update in (
+            fakeapi.message_update(next(update_ids), user_id, "/start"),
+            fakeapi.callback_update(next(update_ids), user_id, "products", photo=False),
+            fakeapi.callback_update(next(update_ids), user_id, "category_phones"),
+            fakeapi.callback_update(next(update_ids), user_id, "category_accessories"),
+            fakeapi.callback_update(next(update_ids), user_id, "about", photo=False),
+        ):
+            started = time.perf_counter()
+            async with http.post(url, json=update, headers=headers) as response:
+                response.raise_for_status()
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def limited(http, user_id):
+        async with semaphore:
+            await session_for(http, user_id)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as http:
+        await asyncio.gather(*(limited(http, 10_000 + i) for i in range(USERS)))
+    elapsed = time.perf_counter() - started
+
+    await runner.cleanup()
+    await bot_app.on_shutdown(dp)
+    await (await dp.bot.get_session()).close()
+
+    latencies.sort()
+    print(f"{len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} updates/sec)")
+    print(f"p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+    print(f"Bot API calls: {len(fakeapi.calls)} "
+          f"(answerCallbackQuery sent separately: {fakeapi.calls.count('answerCallbackQuery')})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,2 +1,30 @@
 BOT_TOKEN = "token"
-ADMINS = [5783655428]
\ No newline at end of file
+ADMINS = [5783655428]
+
+# Updates arrive by long polling unless WEBHOOK_ENABLED is set
+WEBHOOK_ENABLED = False
+WEBHOOK_HOST = "https://example.com"  # public HTTPS address Telegram posts to
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = ""  # checked against the X-Telegram-Bot-Api-Secret-Token header; random per run when empty
+WEBHOOK_MAX_CONNECTIONS = 40  # concurrent requests Telegram may open
+# Answer callback queries in the webhook response: a button press costs one request less, but the
+# spinner on the button keeps turning until the handler returns. False sends every answer the moment
+# the handler makes it.
+WEBHOOK_REPLY_CALLBACKS = True
+WEBAPP_HOST = "0.0.0.0"
+WEBAPP_PORT = 8080
+
+# Prometheus metrics are served on their own port, in both polling and webhook mode
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9800  # worker i of a multi-process setup adds i; 9100 would clash with node_exporter
+
+# Multi-process mode: a front process takes updates (polling or webhook) and hands each user
+# to one of WORKERS processes; worker i listens on 127.0.0.1:WORKER_BASE_PORT + i
+WORKERS = 1
+WORKER_BASE_PORT = 8100
+
+# Chats that bulk-imported photo URLs are sent to once to get Telegram file ids (private channels
+# the bot can post in); the importing admin's own chat when empty. Each chat takes about 20 photos
+# a minute, so list several for big imports.
+UPLOAD_CHAT_IDS = []
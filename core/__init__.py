@@ -1,2 +1,20 @@
 from . import db
+from . import metrics
+from . import callbacks
 from . import keyboards
+from . import ratelimit
+from . import broadcast
+from . import storage
+from . import bot
+from . import webhook
+from . import outbox
+from . import render
+from . import search
+from . import catalog_io
+
+# Before handlers import core.db functions by name
+metrics.instrument_module(db, metrics.queries)
+metrics.add_stats("bot_catalog", "Catalog snapshot cache", db.get_catalog_stats,
+                  counters=("hits", "misses", "reloads"))
+metrics.add_stats("bot_render_cache", "Rendered category page cache", render.get_render_stats,
+                  counters=("hits", "misses"))
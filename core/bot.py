@@ -0,0 +1,80 @@
+import asyncio
+import contextvars
+import logging
+import time
+
+import aiohttp
+from aiogram import Bot
+from aiogram.utils import json
+from aiogram.utils.exceptions import RetryAfter
+
+from core import metrics, ratelimit
+
+# One keep-alive pool to api.telegram.org shared by handlers, broadcasts and the outbox
+API_CONNECTIONS = 100
+KEEPALIVE_TIMEOUT = 60  # Telegram keeps idle connections open about this long
+DNS_CACHE_TTL = 300
+MAX_RETRY_AFTER = 10  # longer flood waits are raised to the caller instead of slept through
+MAX_RETRIES = 3
+
+# Set by core.webhook while an update is being served over a webhook
+webhook_reply = contextvars.ContextVar("webhook_reply", default=None)
+
+
+# Holds the one API call that can ride back in the webhook HTTP response instead of a separate request
+class WebhookReply:
+    def __init__(self, callback_query_id):
+        self.callback_query_id = callback_query_id
+        self.method = None
+        self.data = None
+        self.closed = False
+
+    def take(self, method, data):
+        if self.closed or self.method or method != "answerCallbackQuery" \
+                or (data or {}).get("callback_query_id") != self.callback_query_id:
+            return False
+        self.method, self.data = method, data
+        return True
+
+
+# Every message-sending call waits for core.ratelimit.scheduler first, and flood waits are retried here
+class ShopBot(Bot):
+    async def get_new_session(self):
+        connector = self._connector_class(**dict(
+            self._connector_init,
+            limit=self._connector_init.get("limit") or API_CONNECTIONS,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=DNS_CACHE_TTL,
+        ))
+        return aiohttp.ClientSession(connector=connector, json_serialize=json.dumps)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        reply = webhook_reply.get()
+        if reply is not None and not files and reply.take(method, data):
+            return True
+        limited = method in ratelimit.MESSAGE_METHODS
+        chat_id = (data or {}).get("chat_id") if limited else None
+        for attempt in range(MAX_RETRIES + 1):
+            if limited:
+                waited = time.perf_counter()
+                level = ratelimit.priority.get()
+                await ratelimit.scheduler.acquire(chat_id, level)
+                metrics.api_waits.observe(ratelimit.PRIORITY_NAMES[level], time.perf_counter() - waited)
+            metrics.count_request()
+            started = time.perf_counter()
+            try:
+                return await super().request(method, data, files, **kwargs)
+            except RetryAfter as e:
+                metrics.api_calls.error(method)
+                ratelimit.scheduler.retry_after(chat_id, e.timeout)
+                # Uploaded files have been read already, so those calls are not repeated
+                if files or attempt == MAX_RETRIES or e.timeout > MAX_RETRY_AFTER:
+                    raise
+                logging.warning("Flood wait of %s s on %s to %s, retrying", e.timeout, method, chat_id)
+                if not limited:
+                    await asyncio.sleep(e.timeout)
+            except Exception:
+                metrics.api_calls.error(method)
+                raise
+            finally:
+                metrics.api_calls.observe(method, time.perf_counter() - started)
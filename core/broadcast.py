@@ -0,0 +1,140 @@
+import asyncio
+import collections
+import logging
+import time
+
+from aiogram.utils.exceptions import RetryAfter, BotBlocked, BotKicked, UserDeactivated, \
+    CantInitiateConversation, ChatNotFound, TelegramAPIError
+
+from core import db, ratelimit, workers
+
+SENDERS = 10  # concurrent copy_message calls
+BATCH_SIZE = 200  # jobs fetched from and saved to the database at a time
+PROGRESS_INTERVAL = 3  # seconds between progress message edits
+WATCH_INTERVAL = 2  # with several workers, how often each looks for broadcasts started elsewhere
+
+# The recipient is gone for good, later broadcasts skip them
+GONE_ERRORS = (BotBlocked, BotKicked, UserDeactivated, CantInitiateConversation, ChatNotFound)
+
+_running = {}
+_drained = set()  # broadcasts whose shard this worker has finished while others are still sending
+_watch_task = None
+
+
+async def _send(bot, user_id, from_chat, message_id):
+    # Rate limits are core.ratelimit's job; a flood wait too long for it to sleep through comes back here
+    while True:
+        try:
+            await bot.copy_message(chat_id=user_id, from_chat_id=from_chat, message_id=message_id)
+            return "sent"
+        except RetryAfter as e:
+            logging.warning("Broadcast flood wait: %s s", e.timeout)
+            await asyncio.sleep(e.timeout)
+        except GONE_ERRORS:
+            return "blocked"
+        except Exception as e:
+            logging.warning("Broadcast to %s failed: %r", user_id, e)
+            return "failed"
+
+
+async def _sender(bot, queue, results, from_chat, message_id):
+    while queue:
+        user_id = queue.popleft()
+        results.append((user_id, await _send(bot, user_id, from_chat, message_id)))
+
+
+async def _edit_progress(bot, chat_id, message_id, text):
+    if not message_id:
+        return
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+    except TelegramAPIError:
+        pass
+
+
+async def run_broadcast(bot, broadcast_id):
+    # Runs as its own task, so this only affects the broadcast's own calls
+    ratelimit.priority.set(ratelimit.BULK)
+    _, from_chat, message_id, admin_chat, progress_message_id = await db.get_broadcast(broadcast_id)
+    total = sum((await db.get_broadcast_counts(broadcast_id)).values())
+    last_progress = time.monotonic()
+    # Only the worker that owns the admin's chat edits the progress message
+    show_progress = workers.owns(admin_chat)
+
+    while True:
+        user_ids = await db.get_pending_broadcast_users(broadcast_id, BATCH_SIZE)
+        if not user_ids:
+            break
+        queue, results = collections.deque(user_ids), []
+        try:
+            await asyncio.gather(*(
+                _sender(bot, queue, results, from_chat, message_id) for _ in range(SENDERS)
+            ))
+        finally:
+            # Saved even when cancelled on shutdown, so a resumed broadcast doesn't resend these
+            await db.save_broadcast_results(broadcast_id, results)
+
+        if show_progress and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            done = total - (await db.get_broadcast_counts(broadcast_id)).get("pending", 0)
+            await _edit_progress(bot, admin_chat, progress_message_id,
+                                 f"📤 Отправка сообщения...\n📊 Прогресс: {done}/{total}")
+
+    # Other workers may still be sending their shards; the last one to finish reports
+    if not await db.finish_broadcast(broadcast_id):
+        _drained.add(broadcast_id)
+        return
+    counts = await db.get_broadcast_counts(broadcast_id)
+    await _edit_progress(bot, admin_chat, progress_message_id,
+                         f"📤 Отправка сообщения...\n📊 Прогресс: {total}/{total}")
+    await bot.send_message(
+        admin_chat,
+        f"✅ Рассылка завершена!\n\n"
+        f"📬 Отправлено: {counts.get('sent', 0)}\n"
+        f"❌ Не отправлено: {counts.get('failed', 0)}\n"
+        f"🚫 Заблокировали бота: {counts.get('blocked', 0)}"
+    )
+
+
+def start_broadcast(bot, broadcast_id):
+    if broadcast_id in _running:
+        return _running[broadcast_id]
+    task = asyncio.create_task(run_broadcast(bot, broadcast_id))
+    _running[broadcast_id] = task
+    task.add_done_callback(lambda _: _running.pop(broadcast_id, None))
+    return task
+
+
+# Picks up broadcasts that were interrupted by a restart
+async def resume_broadcasts(bot):
+    for broadcast_id in await db.get_unfinished_broadcast_ids():
+        if broadcast_id not in _running and broadcast_id not in _drained:
+            logging.info("Resuming broadcast %s", broadcast_id)
+            start_broadcast(bot, broadcast_id)
+
+
+# A broadcast is created by the worker that served the admin; the others join in from here
+async def _watch_forever(bot):
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        try:
+            await resume_broadcasts(bot)
+        except Exception:
+            logging.exception("Looking for new broadcasts failed")
+
+
+def start_watching(bot):
+    global _watch_task
+    if _watch_task is None and workers.count > 1:
+        _watch_task = asyncio.create_task(_watch_forever(bot))
+
+
+async def stop_broadcasts():
+    global _watch_task
+    tasks = list(_running.values())
+    if _watch_task is not None:
+        tasks.append(_watch_task)
+        _watch_task = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
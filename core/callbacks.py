@@ -0,0 +1,203 @@
+import collections
+import inspect
+import re
+
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.dispatcher.handler import SkipHandler
+
+from core import metrics
+
+MAX_DATA = 64  # Telegram's limit for callback_data, in bytes
+
+_REQUIRED = object()
+_UNREAD = object()
+_INT = re.compile(r"0|-?[1-9][0-9]*")
+
+
+# Text of one field back to its value, or None; only the exact text new() writes is accepted,
+# so int() leniency like "+5", " 5", "007" or "1_000" never reaches a handler
+def _convert(kind, text):
+    if kind is int:
+        return int(text) if _INT.fullmatch(text) else None
+    if kind is str:
+        return text or None
+    if isinstance(kind, tuple):
+        return text if text in kind else None
+    try:
+        return kind(text)
+    except ValueError:
+        return None
+
+
+# One kind of inline button: a fixed prefix and typed fields, e.g. phone_next_<product_id>.
+# fields are (name, type) or (name, type, default) pairs; fields with defaults may be left off the end.
+# A type is int, str (non-empty), or a tuple of the words the field may take.
+class Callback:
+    __slots__ = ("prefix", "fields", "sep", "required")
+
+    def __init__(self, prefix, *fields, sep="_"):
+        self.prefix = prefix
+        self.fields = tuple((field + (_REQUIRED,))[:3] for field in fields)
+        self.sep = sep
+        self.required = sum(default is _REQUIRED for _, _, default in self.fields)
+
+    def new(self, *values):
+        if not self.required <= len(values) <= len(self.fields):
+            raise TypeError(f"{self.prefix} takes {len(self.fields)} fields, got {len(values)}")
+        data = self.sep.join((self.prefix, *map(str, values)))
+        if len(data.encode()) > MAX_DATA:
+            raise ValueError(f"Callback data {data!r} is longer than {MAX_DATA} bytes")
+        # Refuse data that would come back different, e.g. an empty string or one holding sep
+        expected = {name: value for (name, _, _), value in zip(self.fields, values)}
+        parsed = self.parse(data[len(self.prefix) + len(self.sep):]) if values else {}
+        if parsed is None or any(parsed[name] != value for name, value in expected.items()):
+            raise ValueError(f"Callback data {data!r} does not parse back to {values!r}")
+        return data
+
+    # rest: the part after the prefix and separator; None when it does not fit the fields
+    def parse(self, rest):
+        parts = rest.split(self.sep, len(self.fields) - 1) if self.fields else []
+        values = {}
+        for index, (name, kind, default) in enumerate(self.fields):
+            if index < len(parts):
+                values[name] = _convert(kind, parts[index])
+                if values[name] is None:
+                    return None
+            elif default is _REQUIRED:
+                return None
+            else:
+                values[name] = default
+        return values
+
+    def __repr__(self):
+        return f"Callback({self.prefix!r})"
+
+
+Route = collections.namedtuple("Route", ["handler", "states", "user_ids", "wants_state"])
+
+
+# State filter in aiogram's terms: "*" matches anything, None only users without a state
+def _state_names(state):
+    items = state if isinstance(state, (list, tuple, set, frozenset)) else (state,)
+    names = set()
+    for item in items:
+        if item == "*":
+            return None
+        if isinstance(item, State):
+            names.add(item.state)
+        elif inspect.isclass(item) and issubclass(item, StatesGroup):
+            names.update(item.all_states_names)
+        else:
+            names.add(item)
+    return frozenset(names)
+
+
+# Finds the handler for callback data by walking a trie of prefixes once, instead of trying
+# every registered filter in turn, and hands it the parsed fields as keyword arguments
+class CallbackRouter:
+    def __init__(self):
+        # Nested dicts keyed by character; "" holds a callback without fields ending at that node,
+        # None one whose fields follow
+        self._trie = {}
+        self._routes = {}
+
+    def register(self, handler, callback, state=None, user_id=None):
+        node = self._trie
+        for char in callback.prefix:
+            node = node.setdefault(char, {})
+        key = None if callback.fields else ""
+        if node.get(key, callback) is not callback:
+            raise ValueError(f"Callback prefix {callback.prefix!r} is already taken")
+        node[key] = callback
+        if user_id is not None:
+            user_id = frozenset(user_id if isinstance(user_id, (list, tuple, set, frozenset)) else (user_id,))
+        wants_state = "state" in inspect.signature(handler).parameters
+        self._routes.setdefault(callback, []).append(Route(handler, _state_names(state), user_id, wants_state))
+
+    # Same arguments as register, for use as a decorator; several callbacks may share one handler
+    def handler(self, *callbacks, state=None, user_id=None):
+        def decorator(handler):
+            for callback in callbacks:
+                self.register(handler, callback, state, user_id)
+            return handler
+        return decorator
+
+    # (callback, fields) for the longest registered prefix that data parses as, or None
+    def resolve(self, data):
+        node, found = self._trie, None
+        for position, char in enumerate(data):
+            callback = node.get(None)
+            if callback is not None and char == callback.sep:
+                found = callback, position + 1
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            if "" in node:
+                return node[""], {}
+        if found is None:
+            return None
+        callback, start = found
+        fields = callback.parse(data[start:])
+        return None if fields is None else (callback, fields)
+
+    async def dispatch(self, call, state):
+        match = self.resolve(call.data or "")
+        if match is None:
+            raise SkipHandler()
+        callback, fields = match
+        raw_state = _UNREAD
+        for route in self._routes[callback]:
+            if route.user_ids is not None and call.from_user.id not in route.user_ids:
+                continue
+            if route.states is not None:
+                if raw_state is _UNREAD:
+                    raw_state = await state.get_state()
+                if raw_state not in route.states:
+                    continue
+            metrics.relabel(route.handler.__name__)
+            if route.wants_state:
+                return await route.handler(call, state=state, **fields)
+            return await route.handler(call, **fields)
+        raise SkipHandler()
+
+    # A single aiogram handler in front of all routes; callback handlers registered with aiogram
+    # directly still get the updates the router has no route for
+    def setup(self, dp):
+        dp.register_callback_query_handler(self.dispatch, state="*")
+
+
+router = CallbackRouter()
+
+# ---- user buttons ----
+MENU = Callback("menu")
+ABOUT = Callback("about")
+PRODUCTS = Callback("products")
+SEARCH = Callback("search")
+SEARCH_PAGE = Callback("search", ("token", str), ("index", int))
+CATEGORY_PHONES = Callback("category_phones")
+PHONE_NEXT = Callback("phone_next", ("product_id", int))
+PHONE_PREV = Callback("phone_prev", ("product_id", int))
+CATEGORY_ACCESSORIES = Callback("category_accessories")
+ACCESSORY_NEXT = Callback("accessory_next", ("product_id", int))
+ACCESSORY_PREV = Callback("accessory_prev", ("product_id", int))
+ADD_TO_CART = Callback("add_to_cart", ("product_id", int))
+VIEW_CART = Callback("view_cart")
+CLEAR_CART = Callback("clear_cart")
+CHECKOUT = Callback("checkout")
+CANCEL_PURCHASE = Callback("cancel_purchase")
+
+# ---- admin buttons ----
+ADMIN_CANCEL = Callback("admin_cancel")
+ADMIN_CATEGORY = Callback("cat", ("category", str))
+ADMIN_CONFIRM_PRODUCT = Callback("admin_confirm_product")
+ADMIN_CANCEL_PRODUCT = Callback("admin_cancel_product")
+REMOVE_PRODUCT = Callback("remove_product", ("product_id", int))
+EXPORT = Callback("export", ("fmt", str), sep=":")
+# The page number is only for display; rows are found after (a) the last or before (b) the first user shown
+SEE_USERS = Callback("see_users", ("page", int), ("direction", ("a", "b"), "a"), ("row_id", int, 0), sep=":")
+TREND = Callback("trend", ("days", int), sep=":")
+BACK_TO_USERS = Callback("back_to_users")
+CANCEL_MESSAGE = Callback("no")
+CONFIRM_BROADCAST = Callback("confirm_broadcast")
+CANCEL_BROADCAST = Callback("cancel_broadcast")
@@ -0,0 +1,232 @@
+import asyncio
+import csv
+import json
+import logging
+import math
+import os
+import tempfile
+
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+
+from core import db, ratelimit
+
+FIELDS = ("name", "description", "price", "category", "image")
+CATEGORIES = {
+    "smartphones": "Smartphones", "smartphone": "Smartphones", "телефоны": "Smartphones",
+    "accessories": "Accessories", "accessory": "Accessories", "аксессуары": "Accessories",
+}
+EXPORT_FORMATS = ("csv", "jsonl")
+MAX_REPORTED_ERRORS = 20
+JSON_CHUNK = 64 * 1024
+
+UPLOAD_FLUSH = 50  # resolved file ids written per transaction
+_upload_tasks = set()
+
+
+class ImportReport:
+    def __init__(self):
+        self.added = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, position, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"{position}: {reason}")
+
+
+# ---- parsing ----
+
+# Objects of a top-level JSON array, decoded one at a time from fixed-size reads
+def _iter_json_array(file):
+    decoder = json.JSONDecoder()
+    buffer, eof = "", False
+
+    def read_more():
+        nonlocal buffer, eof
+        chunk = file.read(JSON_CHUNK)
+        eof = not chunk
+        buffer += chunk
+
+    while not buffer.lstrip() and not eof:
+        read_more()
+    buffer = buffer.lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("JSON document must be an array of objects")
+    buffer = buffer[1:]
+    position = 0
+    while True:
+        buffer = buffer.lstrip().removeprefix(",").lstrip()
+        if buffer.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            read_more()
+            continue
+        position += 1
+        yield position, item
+        buffer = buffer[end:]
+
+
+# (position, record dict) pairs from a .csv, .json (array) or .jsonl file. A .jsonl line that is not
+# valid JSON comes as its ValueError in place of the record, and the lines after it are still read
+def iter_records(path):
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        if path.endswith(".csv"):
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        first = ""
+        while not first:
+            first = file.read(1)
+            if not first:
+                return
+            first = first.strip()
+        file.seek(0)
+        if first == "[":
+            yield from _iter_json_array(file)
+            return
+        for position, line in enumerate(file, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    record = e
+                yield position, record
+
+
+def validate(record):
+    if not isinstance(record, dict):
+        return None, "ожидался объект"
+    name = str(record.get("name") or "").strip()
+    if not name:
+        return None, "нет названия"
+    try:
+        price = float(str(record.get("price")).replace(" ", "").replace(",", "."))
+    except ValueError:
+        return None, f"неверная цена {record.get('price')!r}"
+    if not math.isfinite(price):
+        return None, f"неверная цена {record.get('price')!r}"
+    if price < 0:
+        return None, "отрицательная цена"
+    category = CATEGORIES.get(str(record.get("category") or "").strip().lower())
+    if category is None:
+        return None, f"неизвестная категория {record.get('category')!r}"
+    image = str(record.get("image") or "").strip()
+    if not image:
+        return None, "нет фото"
+    return (name, str(record.get("description") or "").strip(), price, category, image), None
+
+
+def _valid_rows(path, report):
+    try:
+        for position, record in iter_records(path):
+            if isinstance(record, ValueError):
+                report.reject(position, f"неверный JSON: {record}")
+                continue
+            row, error = validate(record)
+            if error:
+                report.reject(position, error)
+            else:
+                yield row
+    except (ValueError, csv.Error) as e:
+        # A broken document stops the import; rows before it are kept
+        report.reject("файл", str(e))
+
+
+async def import_catalog(path):
+    report = ImportReport()
+    # Counted by what was committed, not by what passed validation
+    report.added = await db.add_products(_valid_rows(path, report))
+    return report
+
+
+# ---- photos ----
+
+async def _upload(bot, chat_id, url):
+    while True:
+        try:
+            message = await bot.send_photo(chat_id, url, disable_notification=True)
+        except RetryAfter as e:
+            await asyncio.sleep(e.timeout)
+            continue
+        try:
+            await bot.delete_message(chat_id, message.message_id)
+        except TelegramAPIError:
+            pass
+        return message.photo[-1].file_id
+
+
+async def _uploader(bot, chat_id, queue, resolved, counts):
+    while not queue.empty():
+        product_id, url = queue.get_nowait()
+        try:
+            resolved.append((product_id, await _upload(bot, chat_id, url)))
+            counts["uploaded"] += 1
+        except Exception as e:
+            # The URL stays; Telegram fetches it on every view instead
+            logging.warning("Photo %s of product %s failed: %r", url, product_id, e)
+            counts["failed"] += 1
+        if len(resolved) >= UPLOAD_FLUSH:
+            batch = resolved[:]
+            resolved.clear()
+            await db.set_product_images(batch)
+
+
+# Swaps photo URLs of products after after_id for file ids, so users get cached photos.
+# Each chat in chat_ids gets one uploader: core.ratelimit holds every chat to its own rate (20 a
+# minute in a channel or group, 1 a second in a private chat), so more senders to one chat would
+# only queue behind each other. One channel takes about 8 hours for 10k photos; spread big imports
+# over several chats.
+async def resolve_photos(bot, chat_ids, after_id=0, notify_chat=None):
+    ratelimit.priority.set(ratelimit.NOTIFY)
+    queue = asyncio.Queue()
+    for row in await db.get_products_with_image_urls(after_id):
+        queue.put_nowait(row)
+    if queue.empty():
+        return
+    counts, resolved = {"uploaded": 0, "failed": 0}, []
+    try:
+        await asyncio.gather(*(_uploader(bot, chat_id, queue, resolved, counts) for chat_id in chat_ids))
+    finally:
+        if resolved:
+            await db.set_product_images(resolved)
+    if notify_chat:
+        await bot.send_message(notify_chat, f"🖼 Фото загружены: {counts['uploaded']}, ошибок: {counts['failed']}")
+
+
+def start_resolving_photos(bot, chat_ids, after_id=0, notify_chat=None):
+    task = asyncio.create_task(resolve_photos(bot, chat_ids, after_id, notify_chat))
+    _upload_tasks.add(task)
+    task.add_done_callback(_upload_tasks.discard)
+    return task
+
+
+async def stop_uploads():
+    tasks = list(_upload_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ---- export ----
+
+# Writes the catalog to a temporary .csv or .jsonl file batch by batch; the caller removes it
+async def export_catalog(fmt="csv"):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    with os.fdopen(fd, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file) if fmt == "csv" else None
+        if writer:
+            writer.writerow(("id",) + FIELDS)
+        async for row in db.iter_products():
+            if writer:
+                writer.writerow(row)
+            else:
+                file.write(json.dumps(dict(zip(("id",) + FIELDS, row)), ensure_ascii=False) + "\n")
+    return path
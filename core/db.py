@@ -1,14 +1,117 @@
+import array
+import asyncio
+import bisect
+import collections
+import contextlib
+import logging
+import re
 import aiosqlite
 import datetime
+import itertools
+import pytz
+
+from core import workers
+from core.models import Product, CartLine, PRODUCT_COLUMNS
 
 # Database file path
 DB_PATH = "db/bot.db"
+POOL_SIZE = 4
 
-# Initialize database
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Create users table
-        await db.execute("""
+# Applied to every pooled connection
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",  # safe with WAL, no fsync per commit
+    "PRAGMA cache_size = -16000",  # ~16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",  # 256 MB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+# Long-lived connections shared by every query in this module
+class Pool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._connections = []
+        self._idle = None
+        self._open_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def is_open(self):
+        return bool(self._connections)
+
+    async def open(self):
+        async with self._open_lock:
+            if self._connections:
+                return
+            self._idle = asyncio.Queue()
+            for _ in range(self.size):
+                db = await aiosqlite.connect(self.path)
+                for pragma in PRAGMAS:
+                    await db.execute(pragma)
+                self._connections.append(db)
+                self._idle.put_nowait(db)
+
+    async def close(self):
+        async with self._open_lock:
+            connections, self._connections = self._connections, []
+            for db in connections:
+                await db.close()
+            self._idle = None
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        # Opened lazily so scripts that skip on_startup keep working
+        if not self._connections:
+            await self.open()
+        db = await self._idle.get()
+        try:
+            yield db
+        finally:
+            self._idle.put_nowait(db)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        # SQLite has a single writer; serializing here avoids SQLITE_BUSY between pooled connections
+        async with self._write_lock:
+            async with self.connection() as db:
+                try:
+                    yield db
+                except BaseException:
+                    await db.rollback()
+                    raise
+                await db.commit()
+
+
+pool = Pool(DB_PATH)
+
+
+# unicode61 already folds Cyrillic case; ё/е are folded by hand on both sides of the index
+def _fts_fold(column):
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+def _fts_query(text):
+    # Every word becomes a quoted prefix term, so user input can't inject FTS5 syntax
+    words = re.findall(r"\w+", text.lower().replace("ё", "е"))
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# Body of the triggers that keep stats_hourly current
+_STATS_UPSERT = """
+            INSERT INTO stats_hourly (metric, hour, value)
+            VALUES ('{metric}', CAST(strftime('%s', 'now') AS INTEGER) / 3600 * 3600, 1)
+            ON CONFLICT (metric, hour) DO UPDATE SET value = value + 1;
+"""
+
+
+# Schema migrations, applied in order at startup; PRAGMA user_version holds the number of the last applied one.
+# Never edit a migration that has shipped, append a new one instead.
+MIGRATIONS = [
+    # 1: base schema
+    (
+        """
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             telegram_id INTEGER UNIQUE NOT NULL,
@@ -16,10 +119,8 @@ async def init_db():
             username TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        """)
-
-        # Create products table
-        await db.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS products (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
@@ -28,10 +129,8 @@ async def init_db():
             category TEXT,
             image TEXT
         )
-        """)
-
-        # Create cart table
-        await db.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS cart (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
@@ -41,114 +140,856 @@ async def init_db():
             FOREIGN KEY (user_id) REFERENCES users(telegram_id),
             FOREIGN KEY (product_id) REFERENCES products(id)
         )
-        """)
+        """,
+    ),
+    # 2: product search index, kept in sync with products by triggers
+    (
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, description)
+            VALUES (new.id, {_fts_fold('new.name')}, {_fts_fold('new.description')});
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+            INSERT INTO products_fts (rowid, name, description)
+            VALUES (new.id, {_fts_fold('new.name')}, {_fts_fold('new.description')});
+        END
+        """,
+        "DELETE FROM products_fts",
+        f"""
+        INSERT INTO products_fts (rowid, name, description)
+        SELECT id, {_fts_fold('name')}, {_fts_fold('description')} FROM products
+        """,
+    ),
+    # 3: indexes for category listings/navigation and the 24h stats query
+    (
+        "CREATE INDEX IF NOT EXISTS idx_products_category ON products (category, id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)",
+    ),
+    # 4: one cart row per (user, product); duplicates are merged into the oldest row first
+    (
+        """
+        UPDATE cart SET quantity = (
+            SELECT SUM(c.quantity) FROM cart c WHERE c.user_id = cart.user_id AND c.product_id = cart.product_id
+        )
+        WHERE id IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id HAVING COUNT(*) > 1)
+        """,
+        "DELETE FROM cart WHERE id NOT IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_user_product ON cart (user_id, product_id)",
+    ),
+    # 5: persisted broadcasts, one job row per recipient, and users who blocked the bot
+    (
+        "ALTER TABLE users ADD COLUMN blocked INTEGER NOT NULL DEFAULT 0",
+        """
+        CREATE TABLE broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_chat INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            admin_chat INTEGER NOT NULL,
+            progress_message_id INTEGER,
+            finished INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE broadcast_jobs (
+            broadcast_id INTEGER NOT NULL REFERENCES broadcasts(id),
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending / sent / failed / blocked
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX idx_broadcast_jobs_status ON broadcast_jobs (broadcast_id, status)",
+    ),
+    # 6: FSM states (core.storage); data/bucket are compact JSON, rows disappear when a conversation ends
+    (
+        """
+        CREATE TABLE fsm_states (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            state TEXT,
+            data TEXT,
+            bucket TEXT,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX idx_fsm_states_updated_at ON fsm_states (updated_at)",
+    ),
+    # 7: orders with their lines, and an outbox of notifications drained by core.outbox
+    (
+        """
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            username TEXT,
+            total REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE order_items (
+            order_id INTEGER NOT NULL REFERENCES orders(id),
+            product_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (order_id, product_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX idx_orders_user_id ON orders (user_id)",
+        """
+        CREATE TABLE outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX idx_outbox_due ON outbox (failed, next_attempt_at)",
+    ),
+    # 8: counters kept by triggers; 'catalog' changes on every product edit so other processes notice
+    (
+        "CREATE TABLE counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID",
+        "INSERT INTO counters (name, value) VALUES ('catalog', 0)",
+        """
+        CREATE TRIGGER products_catalog_ai AFTER INSERT ON products BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'catalog';
+        END
+        """,
+        """
+        CREATE TRIGGER products_catalog_ad AFTER DELETE ON products BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'catalog';
+        END
+        """,
+        """
+        CREATE TRIGGER products_catalog_au AFTER UPDATE ON products BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'catalog';
+        END
+        """,
+    ),
+    # 9: user total kept by triggers, so the admin screens never COUNT(*) the users table
+    (
+        "INSERT INTO counters (name, value) SELECT 'users', COUNT(*) FROM users",
+        """
+        CREATE TRIGGER users_counter_ai AFTER INSERT ON users BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'users';
+        END
+        """,
+        """
+        CREATE TRIGGER users_counter_ad AFTER DELETE ON users BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'users';
+        END
+        """,
+    ),
+    # 10: hourly rollups of signups, new carts and orders; hour is the UTC unix time the hour starts at.
+    # Signups and orders are backfilled here, carts by migration 11.
+    (
+        """
+        CREATE TABLE stats_hourly (
+            metric TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (metric, hour)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO stats_hourly (metric, hour, value)
+        SELECT 'signups', CAST(strftime('%s', created_at) AS INTEGER) / 3600 * 3600 AS hour, COUNT(*)
+        FROM users WHERE created_at IS NOT NULL GROUP BY hour
+        """,
+        """
+        INSERT INTO stats_hourly (metric, hour, value)
+        SELECT 'orders', CAST(strftime('%s', created_at) AS INTEGER) / 3600 * 3600 AS hour, COUNT(*)
+        FROM orders WHERE created_at IS NOT NULL GROUP BY hour
+        """,
+        f"""
+        CREATE TRIGGER users_stats_ai AFTER INSERT ON users BEGIN
+            {_STATS_UPSERT.format(metric="signups")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER orders_stats_ai AFTER INSERT ON orders BEGIN
+            {_STATS_UPSERT.format(metric="orders")}
+        END
+        """,
+        # A cart is created by the first line a user adds to an empty cart
+        f"""
+        CREATE TRIGGER cart_stats_ai AFTER INSERT ON cart
+        WHEN NOT EXISTS (SELECT 1 FROM cart WHERE user_id = NEW.user_id AND product_id != NEW.product_id)
+        BEGIN
+            {_STATS_UPSERT.format(metric="carts")}
+        END
+        """,
+    ),
+    # 11: cart history for the rollups, from cart.added_at of each open cart's first line. Carts already
+    # checked out or cleared are gone and can't be counted; hours the trigger has counted are left alone.
+    (
+        """
+        INSERT INTO stats_hourly (metric, hour, value)
+        SELECT 'carts', hour, COUNT(*) FROM (
+            SELECT CAST(strftime('%s', MIN(added_at)) AS INTEGER) / 3600 * 3600 AS hour
+            FROM cart WHERE added_at IS NOT NULL GROUP BY user_id
+        )
+        WHERE hour < COALESCE((SELECT MIN(hour) FROM stats_hourly WHERE metric = 'carts'), 1 << 62)
+        GROUP BY hour
+        """,
+    ),
+]
+
+
+# Initialize database
+# Runs on its own connection before the pool opens: connections that cached the old schema
+# would otherwise reject statements that depend on new indexes (e.g. ON CONFLICT targets)
+async def init_db():
+    async with aiosqlite.connect(pool.path) as db:
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        cursor = await db.execute("PRAGMA user_version")
+        version = (await cursor.fetchone())[0]
+
+        for number, statements in enumerate(MIGRATIONS, 1):
+            if number <= version:
+                continue
+            await db.execute("BEGIN")  # sqlite3 would otherwise autocommit each DDL statement
+            try:
+                for statement in statements:
+                    await db.execute(statement)
+                await db.execute(f"PRAGMA user_version = {number}")
+            except BaseException:
+                await db.rollback()
+                raise
+            await db.commit()
+            logging.info("Applied database migration %s", number)
+
+
+# A returning user who had blocked the bot gets broadcasts again
+ADD_USER_SQL = """
+    INSERT INTO users (telegram_id, name, username) VALUES (?, ?, ?)
+    ON CONFLICT (telegram_id) DO UPDATE SET blocked = 0 WHERE blocked = 1
+"""
+
+# KNOWN USERS
+
+# Registered users that are not blocked, so returning users cost no query at all.
+# New users are written in batches, a batch every USER_FLUSH_DELAY seconds or as soon as
+# USER_FLUSH_SIZE are waiting; register_user returns only once its user has committed.
+USER_FLUSH_DELAY = 0.01
+USER_FLUSH_SIZE = 500
+
+_known_users = set()
+_pending_users = {}  # telegram_id -> (name, username, future)
+_user_flush_timer = None
+_user_flush_tasks = set()
+
+async def load_known_users():
+    # A worker only ever sees updates from its own shard of users
+    async with pool.connection() as db:
+        cursor = await db.execute(
+            "SELECT telegram_id FROM users WHERE blocked = 0 AND telegram_id % ? = ?",
+            (workers.count, workers.index)
+        )
+        _known_users.clear()
+        _known_users.update(row[0] for row in await cursor.fetchall())
+
+async def register_user(telegram_id, name, username):
+    global _user_flush_timer
+    if telegram_id in _known_users:
+        return
+    pending = _pending_users.get(telegram_id)
+    if pending is None:
+        future = asyncio.get_running_loop().create_future()
+        _pending_users[telegram_id] = (name, username, future)
+        if len(_pending_users) >= USER_FLUSH_SIZE:
+            _start_user_flush()
+        elif _user_flush_timer is None:
+            _user_flush_timer = asyncio.get_running_loop().call_later(USER_FLUSH_DELAY, _start_user_flush)
+    else:
+        future = pending[2]
+    # A second /start while the first is still queued waits for the same write; shielded so
+    # one of them being cancelled doesn't cancel it for the other
+    await asyncio.shield(future)
+
+def _start_user_flush():
+    task = asyncio.create_task(flush_users())
+    _user_flush_tasks.add(task)
+    task.add_done_callback(_user_flush_tasks.discard)
+
+async def flush_users():
+    global _pending_users, _user_flush_timer
+    if _user_flush_timer is not None:
+        _user_flush_timer.cancel()
+        _user_flush_timer = None
+    batch, _pending_users = _pending_users, {}
+    if not batch:
+        return
+    try:
+        async with pool.transaction() as db:
+            await db.executemany(ADD_USER_SQL, [
+                (telegram_id, name, username) for telegram_id, (name, username, _) in batch.items()
+            ])
+    except Exception as e:
+        # Nobody is marked known, so each of them is written again on their next /start
+        logging.exception("Writing %s new users failed", len(batch))
+        for _, _, future in batch.values():
+            if not future.done():
+                future.set_exception(e)
+        return
+    except BaseException:
+        for _, _, future in batch.values():
+            if not future.done():
+                future.cancel()
+        raise
+    _known_users.update(batch)
+    for _, _, future in batch.values():
+        if not future.done():
+            future.set_result(None)
 
-        await db.commit()
+# CATALOG CACHE
 
+# Immutable view of the products table; readers keep the snapshot they got even if a reload lands meanwhile.
+# products maps id -> Product, categories maps a category to the array of its product ids in id order.
+CatalogSnapshot = collections.namedtuple("CatalogSnapshot", ["version", "categories", "products"])
 
-async def add_user(telegram_id, name, username):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT INTO users (telegram_id, name, username) VALUES (?, ?, ?)", (telegram_id, name, username))
-        await db.commit()
+CATALOG_CHECK_INTERVAL = 1  # seconds between checks for product edits made by other processes
 
-async def user_exists(telegram_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT 1 FROM users WHERE telegram_id = ?", (telegram_id,))
-        exists = await cursor.fetchone()
-        return exists is not None
+_catalog = None
+_catalog_counter = None
+_catalog_lock = asyncio.Lock()
+_catalog_watch_task = None
+catalog_stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+# rows: (id, name, description, price, category, image) in id order
+def build_catalog(version, rows):
+    products, categories, names = {}, {}, {}
+    for product_id, name, description, price, category, image in rows:
+        # Every row carries its own copy of the category string; keep one per category
+        category = names.setdefault(category, category)
+        product = Product(product_id, name, description, price, category, image)
+        ids = categories.get(category)
+        if ids is None:
+            ids = categories[category] = array.array("q")
+        ids.append(product.id)
+        products[product.id] = product
+    return CatalogSnapshot(version, categories, products)
+
+async def _read_catalog_counter(db):
+    cursor = await db.execute("SELECT value FROM counters WHERE name = 'catalog'")
+    return (await cursor.fetchone())[0]
+
+async def reload_catalog():
+    global _catalog, _catalog_counter
+    async with _catalog_lock:
+        async with pool.connection() as db:
+            # Same read transaction as the rows, so the counter matches what was loaded
+            await db.execute("BEGIN")
+            try:
+                _catalog_counter = await _read_catalog_counter(db)
+                cursor = await db.execute(f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY id")
+                rows = await cursor.fetchall()
+            finally:
+                await db.rollback()
+        _catalog = build_catalog(_catalog.version + 1 if _catalog else 1, rows)
+        # Cart lines carry product names and prices
+        _invalidate_cart()
+        catalog_stats["reloads"] += 1
+        return _catalog
+
+async def get_catalog():
+    snapshot = _catalog
+    if snapshot is not None:
+        catalog_stats["hits"] += 1
+        return snapshot
+    catalog_stats["misses"] += 1
+    return await reload_catalog()
+
+# Picks up products added or removed by another worker or an import script
+async def _watch_catalog_forever():
+    while True:
+        await asyncio.sleep(CATALOG_CHECK_INTERVAL)
+        try:
+            async with pool.connection() as db:
+                counter = await _read_catalog_counter(db)
+            if counter != _catalog_counter:
+                await reload_catalog()
+        except Exception:
+            logging.exception("Checking the catalog for changes failed")
+
+def catalog_version():
+    snapshot = _catalog
+    return snapshot.version if snapshot else 0
+
+def get_catalog_stats():
+    snapshot = _catalog
+    return dict(
+        catalog_stats,
+        version=snapshot.version if snapshot else 0,
+        products=len(snapshot.products) if snapshot else 0,
+    )
 
 # COMMANDS FOR ONLINE SHOP BOT
 
 async def add_product(name, description, price, category, image_url):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.transaction() as db:
         await db.execute("INSERT INTO products (name, description, price, category, image) VALUES (?, ?, ?, ?, ?)", (name, description, price, category, image_url))
-        await db.commit()
+    await reload_catalog()
+
+IMPORT_CHUNK = 1000  # rows per transaction in bulk imports
+
+# rows: iterable of (name, description, price, category, image); committed in chunks so
+# a huge import never holds the write lock for long. The catalog is reloaded once at the end.
+async def add_products(rows):
+    added, chunk = 0, []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= IMPORT_CHUNK:
+                added += await _insert_products(chunk)
+                chunk = []
+        if chunk:
+            added += await _insert_products(chunk)
+    finally:
+        if added:
+            await reload_catalog()
+    return added
+
+async def _insert_products(chunk):
+    async with pool.transaction() as db:
+        await db.executemany(
+            "INSERT INTO products (name, description, price, category, image) VALUES (?, ?, ?, ?, ?)", chunk
+        )
+    return len(chunk)
+
+# Products whose photo is still a URL, for core.catalog_io to swap for Telegram file ids
+async def get_products_with_image_urls(after_id: int = 0):
+    async with pool.connection() as db:
+        cursor = await db.execute(
+            "SELECT id, image FROM products WHERE id > ? AND (image LIKE 'http://%' OR image LIKE 'https://%') "
+            "ORDER BY id",
+            (after_id,)
+        )
+        return await cursor.fetchall()
+
+# pairs: iterable of (product_id, file_id)
+async def set_product_images(pairs):
+    async with pool.transaction() as db:
+        await db.executemany("UPDATE products SET image = ? WHERE id = ?", [(image, pid) for pid, image in pairs])
+    await reload_catalog()
+
+# All products in id order, batch by batch, without loading the table into memory
+async def iter_products(batch: int = 1000):
+    last_id = 0
+    while True:
+        async with pool.connection() as db:
+            cursor = await db.execute(
+                "SELECT id, name, description, price, category, image FROM products WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch)
+            )
+            rows = await cursor.fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1][0]
 
 async def delete_product(product_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.transaction() as db:
         await db.execute("DELETE FROM products WHERE id = ?", (product_id,))
-        await db.commit()
+    await reload_catalog()
+
+async def get_category(category: str):
+    catalog = await get_catalog()
+    products = catalog.products
+    return [products[product_id] for product_id in catalog.categories.get(category, ())]
 
 async def get_smartphones():
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT * FROM products WHERE category = ?", ('Smartphones',))
-        products = await cursor.fetchall()
-        return products
+    return await get_category('Smartphones')
 
 async def get_accessories():
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT * FROM products WHERE category = ?", ('Accessories',))
-        products = await cursor.fetchall()
-        return products
+    return await get_category('Accessories')
 
-async def add_to_cart(user_id: int, product_id: int, quantity: int = 1):
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Check if product is already in cart
+async def get_product(product_id: int):
+    catalog = await get_catalog()
+    return catalog.products.get(product_id)
+
+# Products that are gone from the catalog are skipped
+async def get_products(product_ids):
+    products = (await get_catalog()).products
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+# Keyset navigation: the product after/before product_id (or at it for step 0) plus whether it has neighbours
+async def get_category_product(category: str, product_id: int = 0, step: int = 0):
+    catalog = await get_catalog()
+    ids = catalog.categories.get(category, ())
+    if step > 0:
+        position = bisect.bisect_right(ids, product_id)
+    elif step < 0:
+        position = bisect.bisect_left(ids, product_id) - 1
+    else:
+        position = bisect.bisect_left(ids, product_id)
+    if not 0 <= position < len(ids):
+        return None, False, False
+    return catalog.products[ids[position]], position > 0, position < len(ids) - 1
+
+# Ids of the best matches, for core.search sessions
+async def search_product_ids(query: str, limit: int = 100):
+    match = _fts_query(query)
+    if not match:
+        return []
+    async with pool.connection() as db:
         cursor = await db.execute(
-            "SELECT quantity FROM cart WHERE user_id = ? AND product_id = ?",
-            (user_id, product_id)
-        )
-        result = await cursor.fetchone()
-        if result:
-            new_quantity = result[0] + quantity
-            await db.execute(
-                "UPDATE cart SET quantity = ? WHERE user_id = ? AND product_id = ?",
-                (new_quantity, user_id, product_id)
-            )
-        else:
-            await db.execute(
-                "INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)",
-                (user_id, product_id, quantity)
-            )
-        await db.commit()
+            "SELECT rowid FROM products_fts WHERE products_fts MATCH ? ORDER BY rank, rowid LIMIT ?",
+            (match, limit)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+# Relies on the unique index from migration 4
+ADD_TO_CART_SQL = """
+    INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+"""
+
+# One user's cart as shown to them: lines are CartLines in the order added,
+# count is the number of items and total the sum to pay
+CartSummary = collections.namedtuple("CartSummary", ["lines", "count", "total"])
 
-async def get_cart(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+CART_CACHE_SIZE = 10000
+
+_cart_cache = collections.OrderedDict()
+_cart_epoch = 0  # bumped on every invalidation, so a summary read during a write is not cached
+
+def _invalidate_cart(user_id=None):
+    global _cart_epoch
+    _cart_epoch += 1
+    if user_id is None:
+        _cart_cache.clear()
+    else:
+        _cart_cache.pop(user_id, None)
+
+async def get_cart_summary(user_id: int):
+    summary = _cart_cache.get(user_id)
+    if summary is not None:
+        _cart_cache.move_to_end(user_id)
+        return summary
+
+    epoch = _cart_epoch
+    async with pool.connection() as db:
         cursor = await db.execute("""
-            SELECT p.id, p.name, p.description, p.price, p.category, p.image, c.quantity
+            SELECT p.id, p.name, p.price, c.quantity, p.price * c.quantity,
+                   SUM(c.quantity) OVER (), SUM(p.price * c.quantity) OVER ()
             FROM cart c
             JOIN products p ON c.product_id = p.id
             WHERE c.user_id = ?
+            ORDER BY c.id
         """, (user_id,))
-        return await cursor.fetchall()
+        rows = await cursor.fetchall()
+    summary = CartSummary(
+        tuple(CartLine(*row[:5]) for row in rows),
+        rows[0][5] if rows else 0,
+        rows[0][6] if rows else 0,
+    )
+    if epoch == _cart_epoch:
+        _cart_cache[user_id] = summary
+        if len(_cart_cache) > CART_CACHE_SIZE:
+            _cart_cache.popitem(last=False)
+    return summary
+
+# CART WRITES
+
+# Cart writes of all users are queued and committed together, a batch every CART_FLUSH_DELAY
+# seconds or as soon as CART_FLUSH_SIZE writes are waiting. Each caller still returns only
+# after the transaction holding its write has committed.
+CART_FLUSH_DELAY = 0.005
+CART_FLUSH_SIZE = 200
+
+CartWrite = collections.namedtuple("CartWrite", ["sql", "rows", "user_id", "future"])
+
+_cart_writes = []
+_cart_flush_timer = None
+_cart_flush_tasks = set()
+
+async def _write_cart(sql, rows, user_id):
+    global _cart_flush_timer
+    future = asyncio.get_running_loop().create_future()
+    _cart_writes.append(CartWrite(sql, rows, user_id, future))
+    if len(_cart_writes) >= CART_FLUSH_SIZE:
+        _start_cart_flush()
+    elif _cart_flush_timer is None:
+        _cart_flush_timer = asyncio.get_running_loop().call_later(CART_FLUSH_DELAY, _start_cart_flush)
+    await future
+
+def _start_cart_flush():
+    task = asyncio.create_task(flush_cart_writes())
+    _cart_flush_tasks.add(task)
+    task.add_done_callback(_cart_flush_tasks.discard)
+
+async def _commit_cart_writes(batch):
+    async with pool.transaction() as db:
+        # Consecutive writes with the same statement go down in one executemany; order is kept,
+        # so a user's add followed by a clear still ends with an empty cart
+        for sql, group in itertools.groupby(batch, key=lambda write: write.sql):
+            await db.executemany(sql, [row for write in group for row in write.rows])
+
+async def flush_cart_writes():
+    global _cart_writes, _cart_flush_timer
+    if _cart_flush_timer is not None:
+        _cart_flush_timer.cancel()
+        _cart_flush_timer = None
+    batch, _cart_writes = _cart_writes, []
+    if not batch:
+        return
+    try:
+        await _commit_cart_writes(batch)
+    except Exception:
+        # One bad write must not fail everybody else's: retry them one transaction each
+        logging.exception("Cart batch of %s writes failed, retrying them one by one", len(batch))
+        for write in batch:
+            try:
+                await _commit_cart_writes((write,))
+            except Exception as e:
+                _settle_cart_write(write, e)
+            else:
+                _settle_cart_write(write)
+        return
+    except BaseException:
+        for write in batch:
+            if not write.future.done():
+                write.future.cancel()
+        raise
+    for write in batch:
+        _settle_cart_write(write)
+
+def _settle_cart_write(write, error=None):
+    _invalidate_cart(write.user_id)
+    if write.future.done():
+        return  # the caller was cancelled meanwhile
+    if error is None:
+        write.future.set_result(None)
+    else:
+        write.future.set_exception(error)
+
+async def add_to_cart(user_id: int, product_id: int, quantity: int = 1):
+    await _write_cart(ADD_TO_CART_SQL, ((user_id, product_id, quantity),), user_id)
+
+# items: iterable of (product_id, quantity), written in the same transaction
+async def add_to_cart_many(user_id: int, items):
+    await _write_cart(ADD_TO_CART_SQL, [(user_id, product_id, quantity) for product_id, quantity in items], user_id)
 
 async def clear_cart(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    await _write_cart("DELETE FROM cart WHERE user_id = ?", ((user_id,),), user_id)
+
+
+# ORDERS
+
+# cart as returned by get_cart_summary; notifications: iterable of (chat_id, text, parse_mode).
+# The order, its lines, the queued notifications and the emptied cart commit together.
+async def create_order(user_id: int, name: str, phone: str, username, cart, notifications):
+    async with pool.transaction() as db:
+        cursor = await db.execute(
+            "INSERT INTO orders (user_id, name, phone, username, total) VALUES (?, ?, ?, ?, ?)",
+            (user_id, name, phone, username, cart.total)
+        )
+        order_id = cursor.lastrowid
+        await db.executemany(
+            "INSERT INTO order_items (order_id, product_id, name, price, quantity) VALUES (?, ?, ?, ?, ?)",
+            [(order_id, line.product_id, line.name, line.price, line.quantity) for line in cart.lines]
+        )
+        await db.executemany(
+            "INSERT INTO outbox (chat_id, text, parse_mode) VALUES (?, ?, ?)",
+            list(notifications)
+        )
         await db.execute("DELETE FROM cart WHERE user_id = ?", (user_id,))
-        await db.commit()
+    _invalidate_cart(user_id)
+    return order_id
 
+# OUTBOX
 
-# ADMIN COMMANDS
+async def get_due_outbox(now: float, limit: int):
+    async with pool.connection() as db:
+        cursor = await db.execute("""
+            SELECT id, chat_id, text, parse_mode, attempts FROM outbox
+            WHERE failed = 0 AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+        """, (now, limit))
+        return await cursor.fetchall()
 
-async def get_user_ids():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT telegram_id FROM users") as cursor:
-            telegram_ids = [row[0] for row in await cursor.fetchall()]
-    return telegram_ids
+async def delete_outbox(outbox_id: int):
+    async with pool.transaction() as db:
+        await db.execute("DELETE FROM outbox WHERE id = ?", (outbox_id,))
+
+async def retry_outbox(outbox_id: int, next_attempt_at: float, failed: bool = False):
+    async with pool.transaction() as db:
+        await db.execute(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, failed = ? WHERE id = ?",
+            (next_attempt_at, int(failed), outbox_id)
+        )
+
+# ADMIN COMMANDS
 
 async def count_users():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT COUNT(*) FROM users") as cursor:
+    async with pool.connection() as db:
+        async with db.execute("SELECT value FROM counters WHERE name = 'users'") as cursor:
             total_users = (await cursor.fetchone())[0]
     return total_users
 
-# Count users who joined in the past 24 hours
+STATS_TIMEZONE = pytz.timezone("Asia/Bishkek")
+
+async def _stats_since(metric, since):
+    async with pool.connection() as db:
+        cursor = await db.execute(
+            "SELECT hour, value FROM stats_hourly WHERE metric = ? AND hour >= ? ORDER BY hour",
+            (metric, int(since.timestamp()) // 3600 * 3600)
+        )
+        return await cursor.fetchall()
+
+# Users who joined in the last 24 hours, read from the hourly rollup: the hour 24 hours ago is counted
+# whole, so the window is 24 to 25 hours and never misses a signup
 async def count_new_users_last_24_hours():
-    past_24_hours = datetime.datetime.now() - datetime.timedelta(hours=24)
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT COUNT(*) FROM users WHERE created_at >= ?", (past_24_hours,)) as cursor:
-            new_users = (await cursor.fetchone())[0]
-    return new_users
-
-async def get_all_users(page=0, per_page=20):
-    async with aiosqlite.connect(DB_PATH) as db:
-        offset = page * per_page
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=24)
+    return sum(value for _, value in await _stats_since("signups", since))
+
+# Per-day totals for the last `days` days in Asia/Bishkek, oldest first: [(date, {metric: value}), ...]
+async def get_stats_trend(days, metrics=("signups", "carts", "orders")):
+    today = datetime.datetime.now(STATS_TIMEZONE).date()
+    first_day = today - datetime.timedelta(days=days - 1)
+    since = STATS_TIMEZONE.localize(datetime.datetime.combine(first_day, datetime.time()))
+    trend = {first_day + datetime.timedelta(days=i): dict.fromkeys(metrics, 0) for i in range(days)}
+    for metric in metrics:
+        for hour, value in await _stats_since(metric, since):
+            day = datetime.datetime.fromtimestamp(hour, STATS_TIMEZONE).date()
+            trend[day][metric] += value
+    return list(trend.items())
+
+# Keyset pages in signup order: the users right after after_id, or right before before_id.
+# Rows are (id, telegram_id, name); one extra row is fetched to tell whether there is more in that direction.
+async def get_all_users(after_id=0, before_id=None, per_page=20):
+    async with pool.connection() as db:
+        if before_id is None:
+            cursor = await db.execute(
+                "SELECT id, telegram_id, name FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, per_page + 1)
+            )
+            users = await cursor.fetchall()
+            return users[:per_page], len(users) > per_page
         cursor = await db.execute(
-            "SELECT telegram_id, name FROM users LIMIT ? OFFSET ?",
-            (per_page, offset)
+            "SELECT id, telegram_id, name FROM users WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id, per_page + 1)
         )
         users = await cursor.fetchall()
-        return users
+        return users[:per_page][::-1], len(users) > per_page
+
+# BROADCASTS
+
+# Snapshot the recipients as pending jobs so the broadcast survives a restart
+async def create_broadcast(from_chat: int, message_id: int, admin_chat: int):
+    async with pool.transaction() as db:
+        cursor = await db.execute(
+            "INSERT INTO broadcasts (from_chat, message_id, admin_chat) VALUES (?, ?, ?)",
+            (from_chat, message_id, admin_chat)
+        )
+        broadcast_id = cursor.lastrowid
+        await db.execute(
+            "INSERT INTO broadcast_jobs (broadcast_id, user_id) SELECT ?, telegram_id FROM users WHERE blocked = 0",
+            (broadcast_id,)
+        )
+    return broadcast_id
+
+async def set_broadcast_progress_message(broadcast_id: int, progress_message_id: int):
+    async with pool.transaction() as db:
+        await db.execute(
+            "UPDATE broadcasts SET progress_message_id = ? WHERE id = ?",
+            (progress_message_id, broadcast_id)
+        )
+
+async def get_broadcast(broadcast_id: int):
+    async with pool.connection() as db:
+        cursor = await db.execute(
+            "SELECT id, from_chat, message_id, admin_chat, progress_message_id FROM broadcasts WHERE id = ?",
+            (broadcast_id,)
+        )
+        return await cursor.fetchone()
+
+async def get_unfinished_broadcast_ids():
+    async with pool.connection() as db:
+        cursor = await db.execute("SELECT id FROM broadcasts WHERE finished = 0 ORDER BY id")
+        return [row[0] for row in await cursor.fetchall()]
+
+# Each worker sends to its own shard, so blocked users drop out of the right known-users set
+async def get_pending_broadcast_users(broadcast_id: int, limit: int):
+    async with pool.connection() as db:
+        cursor = await db.execute(
+            "SELECT user_id FROM broadcast_jobs WHERE broadcast_id = ? AND status = 'pending' "
+            "AND user_id % ? = ? LIMIT ?",
+            (broadcast_id, workers.count, workers.index, limit)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+# results: iterable of (user_id, status); blocked recipients are also flagged in users so later broadcasts skip them
+async def save_broadcast_results(broadcast_id: int, results):
+    results = list(results)
+    async with pool.transaction() as db:
+        await db.executemany(
+            "UPDATE broadcast_jobs SET status = ? WHERE broadcast_id = ? AND user_id = ?",
+            [(status, broadcast_id, user_id) for user_id, status in results]
+        )
+        await db.executemany(
+            "UPDATE users SET blocked = 1 WHERE telegram_id = ?",
+            [(user_id,) for user_id, status in results if status == "blocked"]
+        )
+    _known_users.difference_update(user_id for user_id, status in results if status == "blocked")
+
+async def get_broadcast_counts(broadcast_id: int):
+    async with pool.connection() as db:
+        cursor = await db.execute(
+            "SELECT status, COUNT(*) FROM broadcast_jobs WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,)
+        )
+        return dict(await cursor.fetchall())
+
+# True for the one caller that actually finished it: with several workers the last shard to drain wins
+async def finish_broadcast(broadcast_id: int):
+    async with pool.transaction() as db:
+        cursor = await db.execute(
+            "UPDATE broadcasts SET finished = 1 WHERE id = ? AND finished = 0 AND NOT EXISTS "
+            "(SELECT 1 FROM broadcast_jobs WHERE broadcast_id = ? AND status = 'pending')",
+            (broadcast_id, broadcast_id)
+        )
+    return cursor.rowcount == 1
 
 async def on_startup():
-    await init_db()
\ No newline at end of file
+    global _catalog_watch_task
+    await init_db()
+    await pool.open()
+    await reload_catalog()
+    await load_known_users()
+    _catalog_watch_task = asyncio.create_task(_watch_catalog_forever())
+
+async def on_shutdown():
+    global _catalog_watch_task
+    if _catalog_watch_task is not None:
+        _catalog_watch_task.cancel()
+    _catalog_watch_task = None
+    await flush_users()
+    await asyncio.gather(*_user_flush_tasks, return_exceptions=True)
+    await flush_cart_writes()
+    await asyncio.gather(*_cart_flush_tasks, return_exceptions=True)
+    await pool.close()
@@ -1,14 +1,34 @@
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
 
+from core import callbacks
+
 start = InlineKeyboardMarkup(
     inline_keyboard=[
-        [InlineKeyboardButton(text="📚 Продукты", callback_data="products")],
-        [InlineKeyboardButton(text="🔍 Поиск", callback_data="search")],
-        [InlineKeyboardButton(text="🛒 Корзина", callback_data="view_cart")],
-        [InlineKeyboardButton(text="ℹ️ О нас", callback_data="about")],
+        [InlineKeyboardButton(text="📚 Продукты", callback_data=callbacks.PRODUCTS.new())],
+        [InlineKeyboardButton(text="🔍 Поиск", callback_data=callbacks.SEARCH.new())],
+        [InlineKeyboardButton(text="🛒 Корзина", callback_data=callbacks.VIEW_CART.new())],
+        [InlineKeyboardButton(text="ℹ️ О нас", callback_data=callbacks.ABOUT.new())],
     ]
 )
 products = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📱 Телефоны", callback_data="category_phones")],
-        [InlineKeyboardButton(text="🎧 Аксессуары", callback_data="category_accessories")]
-])
\ No newline at end of file
+        [InlineKeyboardButton(text="📱 Телефоны", callback_data=callbacks.CATEGORY_PHONES.new())],
+        [InlineKeyboardButton(text="🎧 Аксессуары", callback_data=callbacks.CATEGORY_ACCESSORIES.new())],
+        [InlineKeyboardButton(text="🏠 Главное меню", callback_data=callbacks.MENU.new())]
+])
+
+# Built once and shared by every reply; never mutate these in a handler
+main_menu = InlineKeyboardMarkup().add(
+    InlineKeyboardButton("🏠 Главное меню", callback_data=callbacks.MENU.new())
+)
+added_to_cart = InlineKeyboardMarkup(row_width=1).add(
+    InlineKeyboardButton("🛒 Посмотреть корзину", callback_data=callbacks.VIEW_CART.new()),
+    InlineKeyboardButton("🏠 Главное меню", callback_data=callbacks.MENU.new())
+)
+cart = InlineKeyboardMarkup(row_width=2).add(
+    InlineKeyboardButton("✅ Оформить заказ", callback_data=callbacks.CHECKOUT.new()),
+    InlineKeyboardButton("🗑 Очистить корзину", callback_data=callbacks.CLEAR_CART.new()),
+    InlineKeyboardButton("🏠 Главное меню", callback_data=callbacks.MENU.new())
+)
+cancel_purchase = InlineKeyboardMarkup().add(
+    InlineKeyboardButton("❌ Отмена", callback_data=callbacks.CANCEL_PURCHASE.new())
+)
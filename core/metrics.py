@@ -0,0 +1,245 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import time
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+
+# Upper bounds in seconds, Prometheus style
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    # Upper bound of the bucket holding the given quantile; good enough for /stats
+    def quantile(self, q):
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# One histogram and one error counter per label value, e.g. per handler name
+class Family:
+    def __init__(self, name, label, help_text):
+        self.name = name
+        self.label = label
+        self.help = help_text
+        self.histograms = {}
+        self.errors = {}
+
+    def observe(self, value, seconds):
+        histogram = self.histograms.get(value)
+        if histogram is None:
+            histogram = self.histograms[value] = Histogram()
+        histogram.observe(seconds)
+
+    def error(self, value):
+        self.errors[value] = self.errors.get(value, 0) + 1
+
+    def render(self):
+        lines = [f"# HELP {self.name}_seconds {self.help}", f"# TYPE {self.name}_seconds histogram"]
+        for value, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{self.name}_seconds_bucket{{{self.label}="{value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_seconds_bucket{{{self.label}="{value}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{self.name}_seconds_sum{{{self.label}="{value}"}} {histogram.sum:.6f}')
+            lines.append(f'{self.name}_seconds_count{{{self.label}="{value}"}} {histogram.count}')
+        lines.append(f"# TYPE {self.name}_errors_total counter")
+        for value, count in sorted(self.errors.items()):
+            lines.append(f'{self.name}_errors_total{{{self.label}="{value}"}} {count}')
+        return lines
+
+
+# A running total per label value
+class Counter:
+    def __init__(self, name, label, help_text):
+        self.name = name
+        self.label = label
+        self.help = help_text
+        self.totals = {}
+
+    def add(self, value, amount=1):
+        self.totals[value] = self.totals.get(value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name}_total {self.help}", f"# TYPE {self.name}_total counter"]
+        for value, total in sorted(self.totals.items()):
+            lines.append(f'{self.name}_total{{{self.label}="{value}"}} {total}')
+        return lines
+
+
+# Numbers a module keeps itself, such as cache hits, read each time /metrics is scraped.
+# read returns a dict; the keys in counters only ever grow, the others are current values.
+class Stats:
+    def __init__(self, name, help_text, read, counters=()):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.counters = frozenset(counters)
+
+    def render(self):
+        lines = []
+        for key, value in sorted(self.read().items()):
+            if key in self.counters:
+                metric, kind = f"{self.name}_{key}_total", "counter"
+            else:
+                metric, kind = f"{self.name}_{key}", "gauge"
+            lines += [f"# HELP {metric} {self.help}", f"# TYPE {metric} {kind}", f"{metric} {value}"]
+        return lines
+
+
+handlers = Family("bot_handler", "handler", "Time spent in update handlers")
+queries = Family("bot_db", "function", "Time spent in core.db calls")
+api_calls = Family("bot_api", "method", "Time spent in Telegram Bot API calls")
+api_waits = Family("bot_api_wait", "priority", "Time Bot API calls waited for core.ratelimit")
+FAMILIES = (handlers, queries, api_calls, api_waits)
+# Divided by the handler's count in bot_handler_seconds: round trips to Telegram per update
+api_requests = Counter("bot_handler_api_requests", "handler", "Bot API requests made by update handlers")
+COUNTERS = (api_requests,)
+STATS = []  # filled by add_stats
+
+
+def add_stats(name, help_text, read, counters=()):
+    STATS.append(Stats(name, help_text, read, counters))
+
+# Handler picked for the update being processed and when it started
+_current = contextvars.ContextVar("metrics_current", default=None)
+# Bot API requests made so far by that handler, in a one-item list; emptied when the handler is
+# done, so tasks it started (a broadcast) stop counting towards it
+_requests = contextvars.ContextVar("metrics_requests", default=None)
+
+
+def render():
+    lines = []
+    for family in FAMILIES:
+        lines.extend(family.render())
+    for counter in COUNTERS:
+        lines.extend(counter.render())
+    for stats in STATS:
+        lines.extend(stats.render())
+    return "\n".join(lines) + "\n"
+
+
+def timed(family, label, func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            family.error(label)
+            raise
+        finally:
+            family.observe(label, time.perf_counter() - started)
+    return wrapper
+
+
+# Wraps every public coroutine function of a module; must run before other modules import them by name
+def instrument_module(module, family):
+    for name, func in list(vars(module).items()):
+        if not name.startswith("_") and inspect.iscoroutinefunction(func) \
+                and func.__module__ == module.__name__:
+            setattr(module, name, timed(family, name, func))
+
+
+class MetricsMiddleware(BaseMiddleware):
+    async def on_pre_process_update(self, update, data):
+        _current.set(None)
+
+    async def _started(self, *args):
+        handler = current_handler.get()
+        _current.set((getattr(handler, "__name__", "unknown"), time.perf_counter()))
+        _requests.set([0])
+
+    # aiogram runs post-process in a finally block, so this also sees handlers that raised
+    async def _finished(self, *args):
+        current = _current.get()
+        if current is not None:
+            handlers.observe(current[0], time.perf_counter() - current[1])
+            requests = _requests.get()
+            if requests:
+                api_requests.add(current[0], requests.pop())
+
+    on_process_message = on_process_callback_query = _started
+    on_post_process_message = on_post_process_callback_query = _finished
+
+
+# For a handler that dispatches further by itself, like core.callbacks.router: time the update under
+# the name of the handler it picked instead of its own
+def relabel(name):
+    current = _current.get()
+    if current is not None:
+        _current.set((name, current[1]))
+
+
+# Called by core.bot for every request that actually goes to Telegram
+def count_request():
+    requests = _requests.get()
+    if requests:
+        requests[0] += 1
+
+
+# Registered as a dispatcher errors handler: counts the failure and lets aiogram log it as before
+async def count_error(update, exception):
+    current = _current.get()
+    if current is not None:
+        handlers.error(current[0])
+    return None
+
+
+def setup(dp):
+    dp.middleware.setup(MetricsMiddleware())
+    dp.register_errors_handler(count_error)
+
+
+async def _metrics_view(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+_runner = None
+
+
+async def start_server(host, port):
+    global _runner
+    if _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        # Metrics are not worth keeping the bot down for, e.g. when the port is taken
+        logging.error("Metrics server could not listen on %s:%s, running without it: %s", host, port, e)
+        await runner.cleanup()
+        return
+    _runner = runner
+    logging.info("Metrics on http://%s:%s/metrics", host, port)
+
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,40 @@
+PRODUCT_COLUMNS = "id, name, description, price, category, image"
+
+
+# Read-only after construction: instances are shared by every reader of a catalog snapshot or a
+# cached cart, so changing one in place would change it for all of them
+class _Frozen:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values, strict=True):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+
+# One catalog entry. Slots keep a snapshot of the whole catalog small and attribute access
+# replaces the positional row[...] indexes the handlers used to rely on
+class Product(_Frozen):
+    __slots__ = ("id", "name", "description", "price", "category", "image")
+
+    def __init__(self, id, name, description, price, category, image):
+        super().__init__(id, name, description, price, category, image)
+
+    def __repr__(self):
+        return f"Product(id={self.id!r}, name={self.name!r}, category={self.category!r})"
+
+
+# One line of a cart summary, priced with the product's current price
+class CartLine(_Frozen):
+    __slots__ = ("product_id", "name", "price", "quantity", "line_total")
+
+    def __init__(self, product_id, name, price, quantity, line_total):
+        super().__init__(product_id, name, price, quantity, line_total)
+
+    def __repr__(self):
+        return f"CartLine(product_id={self.product_id!r}, quantity={self.quantity!r})"
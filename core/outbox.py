@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+
+from aiogram.utils.exceptions import RetryAfter, CantParseEntities
+
+from core import db, ratelimit
+
+POLL_INTERVAL = 5  # seconds; wake() skips the wait when something was just queued
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 10  # after that the row stays in outbox with failed = 1
+MAX_BACKOFF = 600
+
+_wakeup = asyncio.Event()
+_task = None
+
+
+async def _deliver(bot, chat_id, text, parse_mode):
+    try:
+        await bot.send_message(chat_id, text, parse_mode=parse_mode)
+    except CantParseEntities:
+        # User-supplied text broke the markup; the plain text is better than nothing
+        await bot.send_message(chat_id, text)
+
+
+async def drain(bot):
+    while True:
+        rows = await db.get_due_outbox(time.time(), BATCH_SIZE)
+        if not rows:
+            return
+        for outbox_id, chat_id, text, parse_mode, attempts in rows:
+            try:
+                await _deliver(bot, chat_id, text, parse_mode)
+            except RetryAfter as e:
+                await db.retry_outbox(outbox_id, time.time() + e.timeout)
+            except Exception as e:
+                failed = attempts + 1 >= MAX_ATTEMPTS
+                logging.warning("Outbox message %s to %s failed (attempt %s): %r",
+                                outbox_id, chat_id, attempts + 1, e)
+                await db.retry_outbox(outbox_id, time.time() + min(2 ** attempts, MAX_BACKOFF), failed)
+            else:
+                await db.delete_outbox(outbox_id)
+
+
+async def _run(bot):
+    ratelimit.priority.set(ratelimit.NOTIFY)
+    while True:
+        try:
+            await drain(bot)
+        except Exception:
+            logging.exception("Draining outbox failed")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def wake():
+    _wakeup.set()
+
+
+def start_outbox(bot):
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run(bot))
+
+
+async def stop_outbox():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
@@ -0,0 +1,131 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+
+from core import workers
+
+# Telegram allows about 30 messages/sec overall, 1 message/sec per private chat and 20/min per group
+GLOBAL_RATE = 25
+GLOBAL_BURST = 5  # sent at once after a quiet spell, on top of the rate: 30 in the busiest second
+CHAT_RATE = 1.0
+CHAT_BURST = 3  # a reply plus an edit or two in a row go out without waiting
+GROUP_RATE = 20 / 60
+MAX_CHATS = 10000  # per-chat entries kept before idle ones are dropped
+
+# Priority classes, most urgent first. Set per task: core.broadcast and core.outbox set theirs when
+# they start, everything else runs on behalf of a user waiting for the reply
+INTERACTIVE = 0
+NOTIFY = 1  # order notifications to admins, catalog photo uploads
+BULK = 2  # broadcasts
+PRIORITY_NAMES = ("interactive", "notify", "bulk")
+
+priority = contextvars.ContextVar("api_priority", default=INTERACTIVE)
+
+# Methods that post or edit a message, the ones Telegram counts against its limits
+MESSAGE_METHODS = frozenset((
+    "sendMessage", "sendPhoto", "sendDocument", "sendVideo", "sendAnimation", "sendAudio", "sendVoice",
+    "sendSticker", "sendMediaGroup", "sendLocation", "sendContact", "copyMessage", "forwardMessage",
+    "editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup",
+))
+
+
+# Decides when each outgoing message may go. Every chat has its own token bucket; the bot as a
+# whole has one more, and every message takes a token from both. When the global bucket runs dry,
+# callers wait and are let through in priority order, so a user's reply goes ahead of a queued
+# broadcast but still counts against the same limit.
+class Scheduler:
+    def __init__(self, rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, group_rate=GROUP_RATE,
+                 burst=GLOBAL_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = [0.0] * len(PRIORITY_NAMES)
+        self._chats = {}  # chat_id -> (tokens, updated); negative tokens are slots already promised
+        self._waiters = []  # heap of (priority, arrival, future)
+        self._arrivals = itertools.count()
+        self._pump = None
+        self._wakeup = None
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _chat_delay(self, chat_id, now):
+        rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+        tokens, updated = self._chats.get(chat_id, (self.chat_burst, now))
+        tokens = min(self.chat_burst, tokens + (now - updated) * rate) - 1
+        if len(self._chats) >= MAX_CHATS:
+            # Drop chats whose bucket has filled up again; the slowest rate keeps group slots safe
+            self._chats = {chat: state for chat, state in self._chats.items()
+                           if state[0] + (now - state[1]) * self.group_rate < self.chat_burst}
+        self._chats[chat_id] = (tokens, now)
+        return -tokens / rate if tokens < 0 else 0
+
+    async def acquire(self, chat_id=None, level=None):
+        level = priority.get() if level is None else level
+        if chat_id is not None:
+            delay = self._chat_delay(chat_id, time.monotonic())
+            if delay:
+                await asyncio.sleep(delay)
+        now = time.monotonic()
+        if not self._waiters and now >= self._paused_until[level]:
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._arrivals), future))
+        if self._pump is None:
+            self._wakeup = asyncio.Event()
+            self._pump = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+        await future
+
+    async def _run(self):
+        try:
+            while self._waiters:
+                level, _, future = self._waiters[0]
+                if future.done():  # the caller was cancelled
+                    heapq.heappop(self._waiters)
+                    continue
+                now = time.monotonic()
+                delay = self._paused_until[level] - now
+                if delay <= 0:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        heapq.heappop(self._waiters)
+                        future.set_result(None)
+                        continue
+                    delay = (1 - self._tokens) / self.rate
+                # A more urgent caller arriving meanwhile is served first
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._pump = None
+
+    # After a RetryAfter: nothing more goes to that chat until Telegram allows it, and the classes
+    # from `level` down stop altogether, since the limit hit may well have been the global one
+    def retry_after(self, chat_id, seconds, level=NOTIFY):
+        now = time.monotonic()
+        if chat_id is not None:
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            self._chats[chat_id] = (1 - seconds * rate, now)
+        for index in range(level, len(self._paused_until)):
+            self._paused_until[index] = max(self._paused_until[index], now + seconds)
+        if self._pump is not None:
+            self._wakeup.set()
+
+
+# Every worker serves its own shard of users, so they split the global rate between them
+scheduler = Scheduler(GLOBAL_RATE / workers.count)
@@ -0,0 +1,96 @@
+import collections
+
+from aiogram.types import ContentType, InputMediaPhoto, Message, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.exceptions import BadRequest, MessageNotModified
+
+from core import callbacks, db
+
+RENDER_CACHE_SIZE = 4096  # product pages kept ready to send
+
+# Caption emoji and previous/next buttons for each browsable category
+CATEGORY_PAGES = {
+    "Smartphones": ("📱", callbacks.PHONE_PREV, callbacks.PHONE_NEXT),
+    "Accessories": ("🎧", callbacks.ACCESSORY_PREV, callbacks.ACCESSORY_NEXT),
+}
+
+_pages = collections.OrderedDict()
+render_stats = {"hits": 0, "misses": 0}
+
+
+def product_caption(product, emoji="📱"):
+    return f"{emoji} {product.name}\n📝 {product.description}\n💵 {product.price} сом"
+
+
+def product_keyboard(product_id, prev_data=None, next_data=None):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    if prev_data:
+        keyboard.insert(InlineKeyboardButton("⬅️", callback_data=prev_data))
+    if next_data:
+        keyboard.insert(InlineKeyboardButton("➡️", callback_data=next_data))
+    keyboard.add(
+        InlineKeyboardButton("➕ В корзину", callback_data=callbacks.ADD_TO_CART.new(product_id)),
+        InlineKeyboardButton("🏠 Главное меню", callback_data=callbacks.MENU.new())
+    )
+    return keyboard
+
+
+# Media and markup for one category page. The key carries the catalog version, so editing
+# the catalog makes old entries unreachable and the LRU bound pushes them out
+def category_page(category, product, has_prev, has_next):
+    key = (category, product.id, db.catalog_version(), has_prev, has_next)
+    page = _pages.get(key)
+    if page is not None:
+        _pages.move_to_end(key)
+        render_stats["hits"] += 1
+        return page
+
+    render_stats["misses"] += 1
+    emoji, prev_callback, next_callback = CATEGORY_PAGES[category]
+    page = (
+        InputMediaPhoto(media=product.image, caption=product_caption(product, emoji)),
+        product_keyboard(
+            product.id,
+            prev_callback.new(product.id) if has_prev else None,
+            next_callback.new(product.id) if has_next else None,
+        ),
+    )
+    _pages[key] = page
+    if len(_pages) > RENDER_CACHE_SIZE:
+        _pages.popitem(last=False)
+    return page
+
+
+def get_render_stats():
+    return dict(render_stats, size=len(_pages))
+
+
+# Turns the message a button was pressed on into the next screen with a single edit: text stays
+# text, a photo gets the new photo. A new message is sent only when the edit can't be made (a text
+# screen over a photo, a message too old to edit), and the old one then loses its buttons.
+# photo is an InputMediaPhoto or a file id/URL captioned with text. Returns the message shown.
+async def show_screen(message, text=None, reply_markup=None, photo=None, parse_mode=None):
+    if photo is not None and not isinstance(photo, InputMediaPhoto):
+        photo = InputMediaPhoto(media=photo, caption=text, parse_mode=parse_mode)
+    try:
+        edited = None
+        if photo is None and message.content_type == ContentType.TEXT:
+            edited = await message.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        elif photo is not None and message.content_type == ContentType.PHOTO:
+            edited = await message.edit_media(photo, reply_markup=reply_markup)
+        if edited is not None:
+            # The edit may come back as a bare True; the message id is unchanged either way
+            return edited if isinstance(edited, Message) else message
+    except MessageNotModified:
+        return message
+    except BadRequest:
+        pass
+
+    if message.reply_markup:
+        try:
+            await message.edit_reply_markup()
+        except BadRequest:
+            pass
+    if photo is not None:
+        return await message.answer_photo(photo.media, caption=photo.caption, parse_mode=photo.parse_mode,
+                                          reply_markup=reply_markup)
+    return await message.answer(text, parse_mode=parse_mode, reply_markup=reply_markup)
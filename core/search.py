@@ -0,0 +1,40 @@
+import collections
+import secrets
+import time
+
+SESSION_TTL = 30 * 60  # seconds a result list stays pageable after the search
+MAX_SESSIONS = 10000  # least recently used sessions go first
+MAX_RESULTS = 100
+
+# token -> (expires_at, product ids in rank order); callbacks carry only the token and an offset
+_sessions = collections.OrderedDict()
+
+
+def create_session(product_ids):
+    now = time.monotonic()
+    # Sessions are ordered by last use, so expired ones are at the front
+    while _sessions and next(iter(_sessions.values()))[0] < now:
+        _sessions.popitem(last=False)
+    token = secrets.token_hex(4)
+    while token in _sessions:
+        token = secrets.token_hex(4)
+    _sessions[token] = (now + SESSION_TTL, tuple(product_ids))
+    if len(_sessions) > MAX_SESSIONS:
+        _sessions.popitem(last=False)
+    return token
+
+
+# Ids of the session, or None when it expired or was evicted; using a session keeps it alive
+def get_session(token):
+    session = _sessions.get(token)
+    now = time.monotonic()
+    if session is None or session[0] < now:
+        _sessions.pop(token, None)
+        return None
+    _sessions[token] = (now + SESSION_TTL, session[1])
+    _sessions.move_to_end(token)
+    return session[1]
+
+
+def session_count():
+    return len(_sessions)
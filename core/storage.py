@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import time
+import typing
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from core import db
+
+STATE_TTL = 24 * 60 * 60  # abandoned conversations are dropped after a day
+EVICT_INTERVAL = 10 * 60
+
+
+def _dump(value):
+    # Empty values are stored as NULL so a finished conversation leaves no row behind
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")) if value else None
+
+
+def _load(text):
+    return json.loads(text) if text else {}
+
+
+# FSM storage on the bot database: states survive restarts and idle users cost nothing
+class SQLiteStorage(BaseStorage):
+    def __init__(self, ttl=STATE_TTL):
+        self.ttl = ttl
+        self._eviction = None
+
+    async def _row(self, conn, chat, user):
+        cursor = await conn.execute(
+            "SELECT state, data, bucket FROM fsm_states WHERE chat_id = ? AND user_id = ?",
+            (chat, user)
+        )
+        return await cursor.fetchone()
+
+    async def _get(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        async with db.pool.connection() as conn:
+            return await self._row(conn, chat, user)
+
+    async def _save(self, conn, chat, user, **columns):
+        if any(value is not None for value in columns.values()):
+            names = ", ".join(columns)
+            updates = ", ".join(f"{name} = excluded.{name}" for name in columns)
+            await conn.execute(f"""
+                INSERT INTO fsm_states (chat_id, user_id, {names}, updated_at) VALUES (?, ?, {", ".join("?" * len(columns))}, ?)
+                ON CONFLICT (chat_id, user_id) DO UPDATE SET {updates}, updated_at = excluded.updated_at
+            """, (chat, user, *columns.values(), int(time.time())))
+            return
+        # Clearing: drop the row if nothing else is kept in it, otherwise null just these columns
+        others = " AND ".join(f"{name} IS NULL" for name in ("state", "data", "bucket") if name not in columns)
+        await conn.execute(
+            f"DELETE FROM fsm_states WHERE chat_id = ? AND user_id = ?{' AND ' + others if others else ''}",
+            (chat, user)
+        )
+        if others:
+            nulls = ", ".join(f"{name} = NULL" for name in columns)
+            await conn.execute(
+                f"UPDATE fsm_states SET {nulls}, updated_at = ? WHERE chat_id = ? AND user_id = ?",
+                (int(time.time()), chat, user)
+            )
+
+    async def _set(self, chat, user, **columns):
+        chat, user = self.check_address(chat=chat, user=user)
+        # Most resets find no row at all (state.finish() on every /start); a read settles that
+        # without queueing for the single writer
+        if all(value is None for value in columns.values()) and await self._get(chat, user) is None:
+            return
+        async with db.pool.transaction() as conn:
+            await self._save(conn, chat, user, **columns)
+
+    async def _update(self, chat, user, column, data, kwargs):
+        chat, user = self.check_address(chat=chat, user=user)
+        async with db.pool.transaction() as conn:
+            row = await self._row(conn, chat, user)
+            value = _load(row[("state", "data", "bucket").index(column)]) if row else {}
+            value.update(data or {}, **kwargs)
+            await self._save(conn, chat, user, **{column: _dump(value)})
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        row = await self._get(chat, user)
+        return row[0] if row and row[0] is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        row = await self._get(chat, user)
+        return _load(row[1]) if row and row[1] else dict(default or {})
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        await self._set(chat, user, state=self.resolve_state(state))
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        await self._set(chat, user, data=_dump(data))
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        await self._update(chat, user, "data", data, kwargs)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        # state.finish() lands here: one reset instead of set_state + set_data
+        if with_data:
+            await self._set(chat, user, state=None, data=None)
+        else:
+            await self._set(chat, user, state=None)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        row = await self._get(chat, user)
+        return _load(row[2]) if row and row[2] else dict(default or {})
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        await self._set(chat, user, bucket=_dump(bucket))
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None,
+                            **kwargs):
+        await self._update(chat, user, "bucket", bucket, kwargs)
+
+    async def evict_expired(self):
+        async with db.pool.transaction() as conn:
+            cursor = await conn.execute(
+                "DELETE FROM fsm_states WHERE updated_at < ?",
+                (int(time.time()) - self.ttl,)
+            )
+        if cursor.rowcount:
+            logging.info("Evicted %s abandoned FSM states", cursor.rowcount)
+
+    async def _evict_forever(self):
+        while True:
+            try:
+                await self.evict_expired()
+            except Exception:
+                logging.exception("FSM state eviction failed")
+            await asyncio.sleep(EVICT_INTERVAL)
+
+    def start_eviction(self):
+        if self._eviction is None:
+            self._eviction = asyncio.create_task(self._evict_forever())
+
+    async def close(self):
+        if self._eviction is not None:
+            self._eviction.cancel()
+            self._eviction = None
+
+    async def wait_closed(self):
+        pass
@@ -0,0 +1,58 @@
+import asyncio
+
+from aiohttp import web
+from aiogram.dispatcher.webhook import WebhookRequestHandler, BaseResponse
+
+from config import WEBHOOK_REPLY_CALLBACKS
+from core import workers
+from core.bot import webhook_reply, WebhookReply
+
+
+class _DeferredCall(BaseResponse):
+    def __init__(self, method, data):
+        self._method = method
+        self._data = data
+
+    @property
+    def method(self):
+        return self._method
+
+    def prepare(self):
+        return self._data
+
+    async def execute_response(self, bot):
+        # data is already a prepared API payload
+        return await bot.request(self._method, self._data)
+
+
+# aiohttp serves requests concurrently; each update is checked against the secret token Telegram sends
+# and, for callback queries, the handler's answer() goes back in the HTTP response
+class WebhookHandler(WebhookRequestHandler):
+    async def post(self):
+        if self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != workers.webhook_secret:
+            raise web.HTTPUnauthorized()
+        return await super().post()
+
+    async def process_update(self, update):
+        if not (WEBHOOK_REPLY_CALLBACKS and update.callback_query):
+            return await super().process_update(update)
+        reply = WebhookReply(update.callback_query.id)
+        token = webhook_reply.set(reply)
+        try:
+            self._reply = reply
+            return await super().process_update(update)
+        finally:
+            webhook_reply.reset(token)
+
+    def get_response(self, results):
+        response = super().get_response(results)
+        reply = getattr(self, "_reply", None)
+        if reply is None:
+            return response
+        reply.closed = True
+        if response is None and reply.method:
+            return _DeferredCall(reply.method, reply.data)
+        if reply.method:
+            # Only one method fits in the response, send the held answer the usual way
+            asyncio.ensure_future(_DeferredCall(reply.method, reply.data).execute_response(self.get_dispatcher().bot))
+        return response
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import sys
+
+import aiohttp
+from aiohttp import web
+
+from config import WEBHOOK_PATH, WEBHOOK_SECRET, WORKER_BASE_PORT
+
+# Set by the front process for each worker it starts; a plain single-process bot is worker 0 of 1
+index = int(os.environ.get("SHOP_WORKER", 0))
+count = int(os.environ.get("SHOP_WORKERS", 1))
+is_worker = "SHOP_WORKER" in os.environ
+# Sent by Telegram and by the front process with every update; without it anyone who finds the URL
+# could post updates in an admin's name. Made up per run when WEBHOOK_SECRET is empty, and handed
+# to workers the same way as their index.
+webhook_secret = os.environ.get("SHOP_WEBHOOK_SECRET") or WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+RESTART_DELAY = 1
+FORWARD_RETRIES = 20  # half a second apart, enough for a crashed worker to come back
+
+
+def shard(user_id, workers):
+    return user_id % workers
+
+
+def owns(user_id):
+    return shard(user_id, count) == index
+
+
+# The user an update belongs to; updates without one all go to the first worker
+def update_user_id(update):
+    for key, value in update.items():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if user:
+                return user["id"]
+    return 0
+
+
+# Receives every update and forwards it to the worker owning the user. Updates of one user are
+# forwarded one at a time, so FSM flows like PurchaseState see them in order.
+class Front:
+    def __init__(self, workers, command=None, base_port=WORKER_BASE_PORT):
+        self.workers = workers
+        self.command = command or (sys.executable, os.path.abspath(sys.argv[0]))
+        self.base_port = base_port
+        self._processes = {}
+        self._supervisors = []
+        self._tails = {}
+        self._tasks = set()
+        self._session = None
+        self._stopping = False
+
+    def _url(self, worker):
+        return f"http://127.0.0.1:{self.base_port + worker}{WEBHOOK_PATH}"
+
+    async def _supervise(self, worker):
+        env = dict(os.environ, SHOP_WORKER=str(worker), SHOP_WORKERS=str(self.workers),
+                   SHOP_WEBHOOK_SECRET=webhook_secret)
+        while not self._stopping:
+            process = await asyncio.create_subprocess_exec(*self.command, env=env)
+            self._processes[worker] = process
+            code = await process.wait()
+            if not self._stopping:
+                logging.error("Worker %s exited with code %s, restarting", worker, code)
+                await asyncio.sleep(RESTART_DELAY)
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        self._supervisors = [asyncio.create_task(self._supervise(worker)) for worker in range(self.workers)]
+        for worker in range(self.workers):
+            while True:
+                try:
+                    async with self._session.get(self._url(worker)):
+                        break
+                except aiohttp.ClientConnectionError:
+                    await asyncio.sleep(0.2)
+        logging.info("%s workers ready", self.workers)
+
+    async def stop(self):
+        self._stopping = True
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.terminate()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    async def _forward(self, worker, update):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": webhook_secret}
+        for attempt in range(FORWARD_RETRIES):
+            try:
+                async with self._session.post(self._url(worker), json=update, headers=headers) as response:
+                    return response.status, response.content_type, await response.read()
+            except aiohttp.ClientConnectionError:
+                if attempt == FORWARD_RETRIES - 1:
+                    raise
+                await asyncio.sleep(0.5)
+
+    # Returns the worker's HTTP status, content type and body; a JSON body is an API call (webhook reply)
+    async def dispatch(self, update):
+        user_id = update_user_id(update)
+        previous = self._tails.get(user_id)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[user_id] = done
+        try:
+            if previous is not None:
+                await asyncio.wait((previous,))
+            return await self._forward(shard(user_id, self.workers), update)
+        finally:
+            done.set_result(None)
+            if self._tails.get(user_id) is done:
+                del self._tails[user_id]
+
+    async def _relay(self, bot, update):
+        try:
+            status, content_type, body = await self.dispatch(update)
+            if content_type == "application/json":
+                # Nobody to reply to in polling mode, so make the worker's webhook reply call here
+                data = json.loads(body)
+                await bot.request(data.pop("method"), data)
+        except Exception:
+            logging.exception("Update %s was not processed", update.get("update_id"))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def poll(self, bot, timeout=20):
+        await bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        while True:
+            payload = {"timeout": timeout} if offset is None else {"timeout": timeout, "offset": offset}
+            try:
+                updates = await bot.request("getUpdates", payload)
+            except Exception:
+                logging.exception("getUpdates failed")
+                await asyncio.sleep(RESTART_DELAY)
+                continue
+            for update in updates:
+                offset = update["update_id"] + 1
+                self._spawn(self._relay(bot, update))
+
+    async def handle_webhook(self, request):
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != webhook_secret:
+            raise web.HTTPUnauthorized()
+        status, content_type, body = await self.dispatch(await request.json())
+        return web.Response(status=status, body=body, content_type=content_type)
@@ -1,4 +1,5 @@
-import asyncio
+import os
+import tempfile
 from datetime import datetime
 import pytz
 from aiogram import types
@@ -6,11 +7,15 @@ from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message, \
     ReplyKeyboardMarkup, KeyboardButton
-from config import ADMINS
+from config import ADMINS, UPLOAD_CHAT_IDS
 from loader import dp, bot
-from core.db import add_product, get_user_ids, count_users, \
-    count_new_users_last_24_hours, get_all_users, get_smartphones, get_accessories, \
-    delete_product  # Added delete_product
+from core.db import add_product, count_users, \
+    count_new_users_last_24_hours, get_stats_trend, get_all_users, get_smartphones, get_accessories, \
+    delete_product, create_broadcast, get_broadcast_counts, set_broadcast_progress_message, get_catalog
+from core.broadcast import start_broadcast
+from core.catalog_io import import_catalog, export_catalog, start_resolving_photos, EXPORT_FORMATS
+from core import callbacks, metrics
+from core.callbacks import router
 
 
 # ============================
@@ -35,30 +40,38 @@ class AdminRemoveProductState(StatesGroup):  # New states for removal
 # ============================
 confirm_keyboard = InlineKeyboardMarkup(row_width=2)
 confirm_keyboard.add(
-    InlineKeyboardButton("✅ Подтвердить", callback_data="admin_confirm_product"),
-    InlineKeyboardButton("❌ Отмена", callback_data="admin_cancel_product")
+    InlineKeyboardButton("✅ Подтвердить", callback_data=callbacks.ADMIN_CONFIRM_PRODUCT.new()),
+    InlineKeyboardButton("❌ Отмена", callback_data=callbacks.ADMIN_CANCEL_PRODUCT.new())
 )
 
 category_keyboard = InlineKeyboardMarkup(row_width=2)
 category_keyboard.add(
-    InlineKeyboardButton("📱 Smartphone", callback_data="cat_smartphone"),
-    InlineKeyboardButton("🎧 Accessories", callback_data="cat_accessories")
+    InlineKeyboardButton("📱 Smartphone", callback_data=callbacks.ADMIN_CATEGORY.new("smartphone")),
+    InlineKeyboardButton("🎧 Accessories", callback_data=callbacks.ADMIN_CATEGORY.new("accessories"))
 )
 category_keyboard.add(
-    InlineKeyboardButton("❌ Отмена", callback_data="admin_cancel")
+    InlineKeyboardButton("❌ Отмена", callback_data=callbacks.ADMIN_CANCEL.new())
 )
 
 cancel_keyboard = InlineKeyboardMarkup()
-cancel_keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data="admin_cancel"))
+cancel_keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data=callbacks.ADMIN_CANCEL.new()))
 
 menu = ReplyKeyboardMarkup(resize_keyboard=True)
 menu.add(KeyboardButton(text='👥 Пользователи'))
 menu.add(KeyboardButton(text='📢 Отправить сообщение'), KeyboardButton(text='🆔 Отправить по ID'))
 menu.add(KeyboardButton(text='⭐ Добавить продукт'), KeyboardButton(text='🗑 Удалить продукт'))  # New button
+menu.add(KeyboardButton(text='📥 Импорт товаров'), KeyboardButton(text='📤 Экспорт товаров'))
+
+export_keyboard = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="CSV", callback_data=callbacks.EXPORT.new("csv")),
+         InlineKeyboardButton(text="JSON", callback_data=callbacks.EXPORT.new("jsonl"))]
+    ]
+)
 
 cancel = InlineKeyboardMarkup(
     inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Отмена", callback_data='no')]
+        [InlineKeyboardButton(text="❌ Отмена", callback_data=callbacks.CANCEL_MESSAGE.new())]
     ]
 )
 
@@ -70,19 +83,30 @@ ratings_button = InlineKeyboardMarkup(
 
 users_button = InlineKeyboardMarkup(
     inline_keyboard=[
-        [InlineKeyboardButton(text="👀 Показать пользователи", callback_data="see_users:0")]
+        [InlineKeyboardButton(text="👀 Показать пользователи", callback_data=callbacks.SEE_USERS.new(0))],
+        [InlineKeyboardButton(text="📈 7 дней", callback_data=callbacks.TREND.new(7)),
+         InlineKeyboardButton(text="📈 30 дней", callback_data=callbacks.TREND.new(30))]
+    ]
+)
+
+trend_back_button = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Вернуться", callback_data=callbacks.BACK_TO_USERS.new())]
     ]
 )
 
 confirm_broadcast = InlineKeyboardMarkup(
     inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Да", callback_data="confirm_broadcast"),
-         InlineKeyboardButton(text="❌ Нет", callback_data="cancel_broadcast")]
+        [InlineKeyboardButton(text="✅ Да", callback_data=callbacks.CONFIRM_BROADCAST.new()),
+         InlineKeyboardButton(text="❌ Нет", callback_data=callbacks.CANCEL_BROADCAST.new())]
     ]
 )
 
 USERS_PER_PAGE = 20
 
+# Values of callbacks.ADMIN_CATEGORY
+CATEGORIES = {"smartphone": "Smartphones", "accessories": "Accessories"}
+
 
 # ============================
 # Admin Menu Handlers
@@ -92,7 +116,30 @@ async def welcome_admin(message: Message):
     await message.answer("👋 Привет, администратор! Чем могу помочь?", reply_markup=menu)
 
 
-@dp.callback_query_handler(text="admin_cancel", state='*')
+# requests: a metrics.Counter by the same label, shown per call
+def _stats_section(title, family, limit=10, requests=None):
+    rows = sorted(family.histograms.items(), key=lambda item: item[1].sum, reverse=True)[:limit]
+    lines = [title]
+    for name, histogram in rows:
+        line = (f"{name}: {histogram.count} шт., ср. {histogram.sum / histogram.count * 1000:.1f} мс, "
+                f"p95 ≤ {histogram.quantile(0.95) * 1000:g} мс, ошибок {family.errors.get(name, 0)}")
+        if requests is not None:
+            line += f", API {requests.totals.get(name, 0) / histogram.count:.1f}/шт."
+        lines.append(line)
+    return "\n".join(lines if rows else [title, "нет данных"])
+
+
+@dp.message_handler(user_id=ADMINS, text='/stats')
+async def show_stats(message: Message):
+    # Sorted by total time spent, so the top line is where the time goes
+    await message.answer("\n\n".join((
+        _stats_section("⚙️ Обработчики:", metrics.handlers, requests=metrics.api_requests),
+        _stats_section("🗄 База данных:", metrics.queries),
+        _stats_section("📡 Telegram API:", metrics.api_calls),
+    )))
+
+
+@router.handler(callbacks.ADMIN_CANCEL, state='*')
 async def process_admin_cancel(call: types.CallbackQuery, state: FSMContext):
     await state.finish()
     await call.message.delete()
@@ -131,10 +178,9 @@ async def process_product_price(message: types.Message, state: FSMContext):
     await AdminProductState.waiting_for_category.set()
 
 
-@dp.callback_query_handler(lambda c: c.data in ["cat_smartphone", "cat_accessories"],
-                           state=AdminProductState.waiting_for_category)
-async def process_product_category(call: types.CallbackQuery, state: FSMContext):
-    category = "Smartphones" if call.data == "cat_smartphone" else "Accessories"
+@router.handler(callbacks.ADMIN_CATEGORY, state=AdminProductState.waiting_for_category)
+async def process_product_category(call: types.CallbackQuery, state: FSMContext, category: str):
+    category = CATEGORIES.get(category, "Accessories")
     await state.update_data(category=category)
     await call.message.edit_text("Отправьте фотографию продукта:", reply_markup=cancel_keyboard)
     await AdminProductState.waiting_for_image.set()
@@ -171,23 +217,85 @@ async def process_invalid_image(message: types.Message, state: FSMContext):
                          reply_markup=cancel_keyboard)
 
 
-@dp.callback_query_handler(lambda c: c.data in ["admin_confirm_product", "admin_cancel_product"],
-                           state=AdminProductState.waiting_for_confirmation)
+@router.handler(callbacks.ADMIN_CONFIRM_PRODUCT, state=AdminProductState.waiting_for_confirmation)
 async def process_confirmation(call: types.CallbackQuery, state: FSMContext):
-    if call.data == "admin_confirm_product":
-        data = await state.get_data()
-        await add_product(
-            data['name'],
-            data['description'],
-            data['price'],
-            data['category'],
-            data['image_file_id']
-        )
-        await call.message.edit_caption(caption="✅ Продукт успешно добавлен!")
-    else:
-        await call.message.edit_caption(caption="❌ Добавление продукта отменено.")
+    data = await state.get_data()
+    await add_product(
+        data['name'],
+        data['description'],
+        data['price'],
+        data['category'],
+        data['image_file_id']
+    )
+    await call.message.edit_caption(caption="✅ Продукт успешно добавлен!")
+    await state.finish()
+    await call.answer()
+
+
+@router.handler(callbacks.ADMIN_CANCEL_PRODUCT, state=AdminProductState.waiting_for_confirmation)
+async def process_confirmation_cancel(call: types.CallbackQuery, state: FSMContext):
+    await call.message.edit_caption(caption="❌ Добавление продукта отменено.")
+    await state.finish()
+    await call.answer()
+
+
+# ============================
+# Bulk Catalog Import / Export
+# ============================
+@dp.message_handler(user_id=ADMINS, text="📥 Импорт товаров")
+async def admin_import_products(message: Message, state: FSMContext):
+    await message.answer(
+        "📥 Отправьте файл .csv, .json или .jsonl с товарами.\n\n"
+        "Поля: name, description, price, category (Smartphones / Accessories), image (ссылка или file_id).\n"
+        "Колонка id при импорте игнорируется.",
+        reply_markup=cancel_keyboard
+    )
+    await state.set_state('import_catalog')
+
+
+@dp.message_handler(state='import_catalog', content_types=types.ContentTypes.DOCUMENT)
+async def process_import_file(message: Message, state: FSMContext):
+    extension = os.path.splitext(message.document.file_name or "")[1].lower()
+    if extension not in (".csv", ".json", ".jsonl"):
+        await message.answer("Нужен файл .csv, .json или .jsonl:", reply_markup=cancel_keyboard)
+        return
+
+    fd, path = tempfile.mkstemp(suffix=extension)
+    os.close(fd)
+    try:
+        await message.document.download(destination_file=path)
+        last_id = max((await get_catalog()).products, default=0)
+        report = await import_catalog(path)
+    finally:
+        os.remove(path)
     await state.finish()
+
+    lines = [f"✅ Добавлено товаров: {report.added}", f"❌ Пропущено строк: {report.rejected}"]
+    if report.errors:
+        lines += ["", *report.errors]
+    await message.answer("\n".join(lines), reply_markup=menu)
+    if report.added:
+        # Photo URLs keep working meanwhile; they are swapped for file ids in the background
+        start_resolving_photos(bot, UPLOAD_CHAT_IDS or [message.chat.id], last_id, message.chat.id)
+
+
+@dp.message_handler(user_id=ADMINS, text="📤 Экспорт товаров")
+async def admin_export_products(message: Message):
+    await message.answer("Выберите формат выгрузки:", reply_markup=export_keyboard)
+
+
+@router.handler(callbacks.EXPORT, user_id=ADMINS)
+async def process_export(call: CallbackQuery, fmt: str):
+    # fmt comes from callback data and ends up in a file name
+    if fmt not in EXPORT_FORMATS:
+        await call.answer("Неизвестный формат.", show_alert=True)
+        return
     await call.answer()
+    path = await export_catalog(fmt)
+    try:
+        await call.message.answer_document(types.InputFile(path, filename=f"catalog.{fmt}"))
+    finally:
+        os.remove(path)
 
 
 # ============================
@@ -199,10 +307,9 @@ async def admin_remove_product(message: Message):
     await AdminRemoveProductState.waiting_for_category.set()
 
 
-@dp.callback_query_handler(lambda c: c.data in ["cat_smartphone", "cat_accessories"],
-                           state=AdminRemoveProductState.waiting_for_category)
-async def process_remove_category(call: CallbackQuery, state: FSMContext):
-    category = "Smartphones" if call.data == "cat_smartphone" else "Accessories"
+@router.handler(callbacks.ADMIN_CATEGORY, state=AdminRemoveProductState.waiting_for_category)
+async def process_remove_category(call: CallbackQuery, state: FSMContext, category: str):
+    category = CATEGORIES.get(category, "Accessories")
     await state.update_data(category=category)
 
     # Fetch products based on category
@@ -217,13 +324,13 @@ async def process_remove_category(call: CallbackQuery, state: FSMContext):
     # Build product list with numbers
     product_list = []
     for idx, product in enumerate(products, 1):
-        product_list.append(f"{idx}. {product[1]} - {product[2]} - {product[3]} сом")
+        product_list.append(f"{idx}. {product.name} - {product.description} - {product.price} сом")
 
     # Create inline buttons for each product
     keyboard = InlineKeyboardMarkup(row_width=3)
     for idx, product in enumerate(products, 1):
-        keyboard.insert(InlineKeyboardButton(str(idx), callback_data=f"remove_product_{product[0]}"))
-    keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data="admin_cancel"))
+        keyboard.insert(InlineKeyboardButton(str(idx), callback_data=callbacks.REMOVE_PRODUCT.new(product.id)))
+    keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data=callbacks.ADMIN_CANCEL.new()))
 
     # Send message with product list
     await call.message.edit_text(
@@ -234,11 +341,8 @@ async def process_remove_category(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith("remove_product_"),
-                           state=AdminRemoveProductState.waiting_for_product_selection)
-async def process_product_removal(call: CallbackQuery, state: FSMContext):
-    product_id = int(call.data.split("_")[-1])
-
+@router.handler(callbacks.REMOVE_PRODUCT, state=AdminRemoveProductState.waiting_for_product_selection)
+async def process_product_removal(call: CallbackQuery, state: FSMContext, product_id: int):
     await delete_product(product_id)
 
     await call.message.edit_text("✅ Продукт успешно удален!")
@@ -249,37 +353,54 @@ async def process_product_removal(call: CallbackQuery, state: FSMContext):
 # ============================
 # User Statistics and Messaging Handlers
 # ============================
-@dp.callback_query_handler(lambda c: c.data.startswith("see_users"))
-async def handle_see_users(callback: CallbackQuery):
-    page = int(callback.data.split(":")[1])
-    all_users = await get_all_users(page=page, per_page=USERS_PER_PAGE)
+@router.handler(callbacks.SEE_USERS)
+async def handle_see_users(callback: CallbackQuery, page: int, direction: str, row_id: int):
+    if direction == "b":
+        all_users, _ = await get_all_users(before_id=row_id, per_page=USERS_PER_PAGE)
+        has_next = True
+    else:
+        all_users, has_next = await get_all_users(after_id=row_id, per_page=USERS_PER_PAGE)
     total_users = await count_users()
-    timestamp = datetime.now(pytz.timezone('Asia/Bishkek')).strftime('%H:%M:%S %d.%m.%Y')
 
     if not all_users:
         await callback.message.edit_text("😕 Нет пользователей.")
         return
 
-    total_pages = (total_users + USERS_PER_PAGE - 1) // USERS_PER_PAGE
+    total_pages = max(page + 1, (total_users + USERS_PER_PAGE - 1) // USERS_PER_PAGE)
     response_lines = [f"👥 Все пользователи (Страница {page + 1}/{total_pages}):", ""]
-    for user_id, name in all_users:
+    for _, user_id, name in all_users:
         name1 = f"<a href='tg://user?id={user_id}'>{name}</a>"
         response_lines.append(f"👤 {name1} - {user_id}")
     response = "\n".join(response_lines)
 
     nav_buttons = [
-        InlineKeyboardButton(text="⬅️ Назад", callback_data=f"see_users:{page - 1}") if page > 0 else None,
+        InlineKeyboardButton(text="⬅️ Назад",
+                             callback_data=callbacks.SEE_USERS.new(page - 1, "b", all_users[0][0])) if page > 0 else None,
         InlineKeyboardButton(text="➡️ Вперед",
-                             callback_data=f"see_users:{page + 1}") if page < total_pages - 1 else None
+                             callback_data=callbacks.SEE_USERS.new(page + 1, "a", all_users[-1][0])) if has_next else None
     ]
     nav_buttons = [btn for btn in nav_buttons if btn]
-    back_button = [InlineKeyboardButton(text="🔙 Вернуться", callback_data="back_to_users")]
+    back_button = [InlineKeyboardButton(text="🔙 Вернуться", callback_data=callbacks.BACK_TO_USERS.new())]
 
     pagination_keyboard = InlineKeyboardMarkup(inline_keyboard=[nav_buttons, back_button])
     await callback.message.edit_text(response, reply_markup=pagination_keyboard, parse_mode="HTML")
 
 
-@dp.callback_query_handler(text="back_to_users")
+@router.handler(callbacks.TREND, user_id=ADMINS)
+async def handle_trend(callback: CallbackQuery, days: int):
+    trend = await get_stats_trend(days)
+    totals = {metric: sum(values[metric] for _, values in trend) for metric in ("signups", "carts", "orders")}
+    response_lines = [f"📈 Динамика за {days} дней (Asia/Bishkek):", "👤 новые / 🛒 корзины / 📦 заказы", ""]
+    for day, values in trend:
+        response_lines.append(f"{day.strftime('%d.%m')}: 👤 {values['signups']}  🛒 {values['carts']}  "
+                              f"📦 {values['orders']}")
+    response_lines.append("")
+    response_lines.append(f"Всего: 👤 {totals['signups']}  🛒 {totals['carts']}  📦 {totals['orders']}")
+    await callback.message.edit_text("\n".join(response_lines), reply_markup=trend_back_button)
+    await callback.answer()
+
+
+@router.handler(callbacks.BACK_TO_USERS)
 async def handle_back_to_users(callback: CallbackQuery):
     total_users = await count_users()
     last_24h_users = await count_new_users_last_24_hours()
@@ -312,7 +433,7 @@ async def msg_all(message: types.Message, state: FSMContext):
     await state.update_data(prompt_msg_id=message_send.message_id)
 
 
-@dp.callback_query_handler(text='no', state=['msg_all', 'get_user_id', 'msg_by_id'])
+@router.handler(callbacks.CANCEL_MESSAGE, state=['msg_all', 'get_user_id', 'msg_by_id'])
 async def no_msg_all(call: CallbackQuery, state: FSMContext):
     await call.message.edit_text("🚫 Рассылка отменена.")
     await state.finish()
@@ -334,40 +455,24 @@ async def msg_to_all(message: types.Message, state: FSMContext):
                          reply_markup=confirm_broadcast)
 
 
-@dp.callback_query_handler(text="confirm_broadcast", state='msg_all')
+@router.handler(callbacks.CONFIRM_BROADCAST, state='msg_all')
 async def confirm_broadcast_handler(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup(reply_markup=None)
     data = await state.get_data()
     msg_id = data['msg_id']
     from_chat = data['from_chat']
 
-    total_users_id = await get_user_ids()
-    total = len(total_users_id)
-    success = 0
-    error = 0
+    broadcast_id = await create_broadcast(from_chat, msg_id, callback.message.chat.id)
+    total = (await get_broadcast_counts(broadcast_id)).get("pending", 0)
 
     progress_msg = await callback.message.answer(f"📤 Отправка сообщения...\n📊 Прогресс: 0/{total}")
+    await set_broadcast_progress_message(broadcast_id, progress_msg.message_id)
     await state.finish()
-    for i, user_id in enumerate(total_users_id, 1):
-        try:
-            await bot.copy_message(chat_id=user_id, from_chat_id=from_chat, message_id=msg_id)
-            success += 1
-        except Exception:
-            error += 1
-
-        if i % 10 == 0 or i == total:
-            await bot.edit_message_text(
-                f"📤 Отправка сообщения...\n📊 Прогресс: {success + error}/{total}",
-                chat_id=callback.message.chat.id,
-                message_id=progress_msg.message_id
-            )
-        await asyncio.sleep(0.04)
-
-    await callback.message.answer(
-        f"✅ Рассылка завершена!\n\n📬 Отправлено: {success}\n❌ Не отправлено: {error}")
-
-
-@dp.callback_query_handler(text="cancel_broadcast", state='msg_all')
+    # Runs in the background and resumes after a restart; the summary is sent when it finishes
+    start_broadcast(bot, broadcast_id)
+
+
+@router.handler(callbacks.CANCEL_BROADCAST, state='msg_all')
 async def cancel_broadcast_handler(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup(reply_markup=None)
     await callback.message.answer("🚫 Рассылка отменена.")
@@ -401,7 +506,7 @@ async def preview_message_for_user(message: types.Message, state: FSMContext):
     await message.answer("👀 Это предварительный просмотр.\nОтправить пользователю?", reply_markup=confirm_broadcast)
 
 
-@dp.callback_query_handler(text="confirm_broadcast", state='msg_by_id')
+@router.handler(callbacks.CONFIRM_BROADCAST, state='msg_by_id')
 async def confirm_send_to_user(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup(reply_markup=None)
     data = await state.get_data()
@@ -416,7 +521,7 @@ async def confirm_send_to_user(callback: CallbackQuery, state: FSMContext):
     await state.finish()
 
 
-@dp.callback_query_handler(text="cancel_broadcast", state='msg_by_id')
+@router.handler(callbacks.CANCEL_BROADCAST, state='msg_by_id')
 async def cancel_send_to_user(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup(reply_markup=None)
     await callback.message.answer("🚫 Отправка сообщения отменена.")
@@ -1,17 +1,20 @@
 from aiogram import types
-from aiogram.types import (
-    InputMediaPhoto,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
-    CallbackQuery
-)
+from aiogram.types import CallbackQuery
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 
 from config import ADMINS
-from core.keyboards import start
+from core.keyboards import start, products as products_keyboard, main_menu, added_to_cart, cart as cart_keyboard, \
+    cancel_purchase as cancel_purchase_keyboard
 from loader import dp, bot
-from core.db import get_smartphones, get_accessories, add_to_cart, get_cart, clear_cart
+from core import callbacks
+from core.callbacks import router
+from core.db import add_to_cart, get_cart_summary, clear_cart, \
+    search_product_ids, get_product, get_category_product, create_order
+from core.outbox import wake as wake_outbox
+from core.render import category_page, product_caption, product_keyboard, show_screen
+from core.search import create_session as create_search_session, get_session as get_search_session, \
+    MAX_RESULTS as MAX_SEARCH_RESULTS
 
 # ---------------- State Definitions ----------------
 class PurchaseState(StatesGroup):
@@ -24,15 +27,15 @@ class QuantityState(StatesGroup):
 class SearchState(StatesGroup):
     waiting_for_query = State()  # Only used for initial query input
 
+# Callback handlers answer first, so with polling the button spinner stops before the screen is
+# redrawn. Over a webhook the answer rides in the HTTP response (config.WEBHOOK_REPLY_CALLBACKS)
+# and reaches the user when the handler returns, in exchange for one request less per press.
+
 # ---------------- Main Menu Handler ----------------
-@dp.callback_query_handler(lambda c: c.data == "menu")
+@router.handler(callbacks.MENU)
 async def show_main_menu(call: CallbackQuery):
-    await call.message.edit_reply_markup()
-    await call.message.answer(
-        "📢 Вы вернулись в главное меню!",
-        reply_markup=start
-    )
     await call.answer()
+    await show_screen(call.message, "📢 Вы вернулись в главное меню!", reply_markup=start)
 
 # ---------------- Stop Handler ----------------
 @dp.message_handler(commands=["stop"], state="*")
@@ -41,198 +44,135 @@ async def stop_handler(message: types.Message, state: FSMContext):
     await message.answer("Действие остановлено.", reply_markup=start)
 
 # ---------------- About Handler ----------------
-@dp.callback_query_handler(lambda c: c.data == "about")
+@router.handler(callbacks.ABOUT)
 async def show_about(call: CallbackQuery):
-    await call.message.edit_reply_markup()
-    await call.message.answer(
+    await call.answer()
+    await show_screen(
+        call.message,
         "ℹ️ О нас:\n\n"
         "Мы - ваш надежный магазин электроники! 📱🎧\n"
         "Предлагаем лучшие смартфоны и аксессуары по доступным ценам.\n\n"
         "Instagram: <a href='https://www.instagram.com/ideal_mobile_kg/'>IDEAL_MOBILE_KG</a>\n",
-        reply_markup=InlineKeyboardMarkup().add(
-            InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-        ),
+        reply_markup=main_menu,
         parse_mode=types.ParseMode.HTML
     )
-    await call.answer()
 
 # ---------------- Products Category Handler ----------------
-@dp.callback_query_handler(lambda c: c.data == "products")
+@router.handler(callbacks.PRODUCTS)
 async def show_products_category(callback_query: CallbackQuery):
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📱 Телефоны", callback_data="category_phones")],
-        [InlineKeyboardButton(text="🎧 Аксессуары", callback_data="category_accessories")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu")]
-    ])
-    await callback_query.message.edit_reply_markup()
-    await callback_query.message.answer("Выберите категорию товаров:", reply_markup=keyboard)
     await callback_query.answer()
+    await show_screen(callback_query.message, "Выберите категорию товаров:", reply_markup=products_keyboard)
 
 # ---------------- Search Handlers ----------------
-@dp.callback_query_handler(lambda c: c.data == "search")
+@router.handler(callbacks.SEARCH)
 async def initiate_search(call: CallbackQuery, state: FSMContext):
-    await call.message.edit_reply_markup()
-    await call.message.answer("🔍 Введите название товара для поиска:\nВведите /stop чтобы остановить действие")
-    await SearchState.waiting_for_query.set()
     await call.answer()
+    await show_screen(call.message, "🔍 Введите название товара для поиска:\nВведите /stop чтобы остановить действие")
+    await SearchState.waiting_for_query.set()
 
 @dp.message_handler(state=SearchState.waiting_for_query, content_types=types.ContentTypes.TEXT)
 async def process_search_query(message: types.Message, state: FSMContext):
-    query = message.text.lower()
-    all_products = await get_smartphones() + await get_accessories()
-    search_results = [p for p in all_products if query in p[1].lower()]
+    product_ids = await search_product_ids(message.text, MAX_SEARCH_RESULTS)
 
-    if not search_results:
+    if not product_ids:
         await message.answer(
             "❌ Товары не найдены",
-            reply_markup=InlineKeyboardMarkup().add(
-                InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-            )
+            reply_markup=main_menu
         )
         await state.finish()
         return
 
-    await state.update_data(search_results=search_results)  # Store results in state temporarily
-    await show_search_results(message, query, 0)  # Pass query and initial index
+    # Pages are looked up by token from here on, the query is not searched again
+    await show_search_results(message, create_search_session(product_ids), 0, product_ids)
     await state.finish()  # Finish state after showing first result
 
-async def show_search_results(message: types.Message, query: str, current_index: int):
-    all_products = await get_smartphones() + await get_accessories()
-    search_results = [p for p in all_products if query.lower() in p[1].lower()]
+# in_place: page through results on the message the button was pressed on
+async def show_search_results(message: types.Message, token: str, current_index: int, product_ids, in_place=False):
+    product = await get_product(product_ids[current_index]) if 0 <= current_index < len(product_ids) else None
 
-    if not 0 <= current_index < len(search_results):
-        await message.answer("Результат не найден.", reply_markup=InlineKeyboardMarkup().add(
-            InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-        ))
+    if not product:
+        await message.answer("Результат не найден.", reply_markup=main_menu)
         return
 
-    product = search_results[current_index]
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    if current_index > 0:
-        keyboard.insert(InlineKeyboardButton("⬅️", callback_data=f"search_{query}_{current_index - 1}"))
-    if current_index < len(search_results) - 1:
-        keyboard.insert(InlineKeyboardButton("➡️", callback_data=f"search_{query}_{current_index + 1}"))
-    keyboard.add(
-        InlineKeyboardButton("➕ В корзину", callback_data=f"add_to_cart_{product[0]}"),
-        InlineKeyboardButton("🏠 Главное меню", callback_data="menu")  # Removed "📚 Меню" button
+    keyboard = product_keyboard(
+        product.id,
+        callbacks.SEARCH_PAGE.new(token, current_index - 1) if current_index > 0 else None,
+        callbacks.SEARCH_PAGE.new(token, current_index + 1) if current_index + 1 < len(product_ids) else None,
     )
-
-    await message.answer_photo(
-        photo=product[5],
-        caption=f"🔍 Результат поиска:\n📱 {product[1]}\n📝 {product[2]}\n💵 {product[3]} сом",
-        reply_markup=keyboard
-    )
-
-@dp.callback_query_handler(lambda c: c.data.startswith("search_"))
-async def process_search_action(call: CallbackQuery):
-    await call.message.delete()
-    try:
-        _, query, index = call.data.split("_")
-        current_index = int(index)
-        await show_search_results(call.message, query, current_index)
-    except (ValueError, IndexError):
-        await call.answer("Ошибка при обработке запроса.", show_alert=True)
+    caption = "🔍 Результат поиска:\n" + product_caption(product)
+    if in_place:
+        await show_screen(message, caption, reply_markup=keyboard, photo=product.image)
+    else:
+        await message.answer_photo(photo=product.image, caption=caption, reply_markup=keyboard)
+
+@router.handler(callbacks.SEARCH_PAGE)
+async def process_search_action(call: CallbackQuery, token: str, index: int):
+    product_ids = get_search_session(token)
+    if product_ids is None:
+        await call.answer("Результаты поиска устарели, выполните поиск заново.", show_alert=True)
+        return
     await call.answer()
+    await show_search_results(call.message, token, index, product_ids, in_place=True)
 
 # ---------------- Smartphone Buying Handlers ----------------
-@dp.callback_query_handler(lambda c: c.data == "category_phones")
+@router.handler(callbacks.CATEGORY_PHONES)
 async def show_phones(call: CallbackQuery):
-    await show_phone_products(call, 0)
+    await show_phone_products(call)
 
-async def show_phone_products(call: CallbackQuery, current_index: int):
-    products = await get_smartphones()
-    if not 0 <= current_index < len(products):
+async def show_phone_products(call: CallbackQuery, product_id: int = 0, step: int = 0):
+    product, has_prev, has_next = await get_category_product("Smartphones", product_id, step)
+    if not product:
         await call.answer("Продукт не найден.", show_alert=True)
         return
 
-    product = products[current_index]
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    if current_index > 0:
-        keyboard.insert(InlineKeyboardButton("⬅️", callback_data=f"phone_prev_{current_index}"))
-    if current_index < len(products) - 1:
-        keyboard.insert(InlineKeyboardButton("➡️", callback_data=f"phone_next_{current_index}"))
-    keyboard.add(
-        InlineKeyboardButton("➕ В корзину", callback_data=f"add_to_cart_{product[0]}"),
-        InlineKeyboardButton("🏠 Главное меню", callback_data="menu")  # Removed "📚 Меню" button
-    )
-
-    await call.message.edit_media(
-        media=InputMediaPhoto(
-            media=product[5],
-            caption=f"📱 {product[1]}\n📝 {product[2]}\n💵 {product[3]} сом"
-        ),
-        reply_markup=keyboard
-    )
+    media, keyboard = category_page("Smartphones", product, has_prev, has_next)
     await call.answer()
+    await show_screen(call.message, photo=media, reply_markup=keyboard)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("phone_next_"))
-async def phone_next(call: CallbackQuery):
-    current_index = int(call.data.split("_")[-1]) + 1
-    await show_phone_products(call, current_index)
+@router.handler(callbacks.PHONE_NEXT)
+async def phone_next(call: CallbackQuery, product_id: int):
+    await show_phone_products(call, product_id, 1)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("phone_prev_"))
-async def phone_prev(call: CallbackQuery):
-    current_index = int(call.data.split("_")[-1]) - 1
-    await show_phone_products(call, current_index)
+@router.handler(callbacks.PHONE_PREV)
+async def phone_prev(call: CallbackQuery, product_id: int):
+    await show_phone_products(call, product_id, -1)
 
 # ---------------- Accessories Buying Handlers ----------------
-@dp.callback_query_handler(lambda c: c.data == "category_accessories")
+@router.handler(callbacks.CATEGORY_ACCESSORIES)
 async def show_accessories(call: CallbackQuery):
-    await show_accessories_products(call, 0)
+    await show_accessories_products(call)
 
-async def show_accessories_products(call: CallbackQuery, current_index: int):
-    products = await get_accessories()
-    if not 0 <= current_index < len(products):
+async def show_accessories_products(call: CallbackQuery, product_id: int = 0, step: int = 0):
+    product, has_prev, has_next = await get_category_product("Accessories", product_id, step)
+    if not product:
         await call.answer("Продукт не найден.", show_alert=True)
         return
 
-    product = products[current_index]
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    if current_index > 0:
-        keyboard.insert(InlineKeyboardButton("⬅️", callback_data=f"accessory_prev_{current_index}"))
-    if current_index < len(products) - 1:
-        keyboard.insert(InlineKeyboardButton("➡️", callback_data=f"accessory_next_{current_index}"))
-    keyboard.add(
-        InlineKeyboardButton("➕ В корзину", callback_data=f"add_to_cart_{product[0]}"),
-        InlineKeyboardButton("🏠 Главное меню", callback_data="menu")  # Removed "📚 Меню" button
-    )
-
-    await call.message.edit_media(
-        media=InputMediaPhoto(
-            media=product[5],
-            caption=f"🎧 {product[1]}\n📝 {product[2]}\n💵 {product[3]} сом"
-        ),
-        reply_markup=keyboard
-    )
+    media, keyboard = category_page("Accessories", product, has_prev, has_next)
     await call.answer()
+    await show_screen(call.message, photo=media, reply_markup=keyboard)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("accessory_next_"))
-async def accessory_next(call: CallbackQuery):
-    current_index = int(call.data.split("_")[-1]) + 1
-    await show_accessories_products(call, current_index)
+@router.handler(callbacks.ACCESSORY_NEXT)
+async def accessory_next(call: CallbackQuery, product_id: int):
+    await show_accessories_products(call, product_id, 1)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("accessory_prev_"))
-async def accessory_prev(call: CallbackQuery):
-    current_index = int(call.data.split("_")[-1]) - 1
-    await show_accessories_products(call, current_index)
+@router.handler(callbacks.ACCESSORY_PREV)
+async def accessory_prev(call: CallbackQuery, product_id: int):
+    await show_accessories_products(call, product_id, -1)
 
 # ---------------- Cart Management Handlers ----------------
-@dp.callback_query_handler(lambda c: c.data.startswith("add_to_cart_"))
-async def add_to_cart_handler(call: CallbackQuery, state: FSMContext):
-    product_id = int(call.data.split("_")[-1])
-    user_id = call.from_user.id
-
-    all_products = await get_smartphones() + await get_accessories()
-    product = next((p for p in all_products if p[0] == product_id), None)
+@router.handler(callbacks.ADD_TO_CART)
+async def add_to_cart_handler(call: CallbackQuery, state: FSMContext, product_id: int):
+    product = await get_product(product_id)
     if not product:
         await call.answer("Продукт не найден.", show_alert=True)
         return
 
-    await state.update_data(product_id=product_id, product=product)
-    await call.message.edit_reply_markup()
-    await call.message.answer("Введите количество товара:\nВведите /stop чтобы остановить действие")
-    await QuantityState.waiting_for_quantity.set()
     await call.answer()
+    await state.update_data(product_id=product_id, product_name=product.name)
+    # The product photo stays in the chat above the prompt
+    await show_screen(call.message, "Введите количество товара:\nВведите /stop чтобы остановить действие")
+    await QuantityState.waiting_for_quantity.set()
 
 @dp.message_handler(state=SearchState.waiting_for_query, content_types=types.ContentTypes.ANY)
 async def invalid_search_input(message: types.Message):
@@ -250,86 +190,52 @@ async def process_quantity(message: types.Message, state: FSMContext):
 
     data = await state.get_data()
     product_id = data["product_id"]
-    product = data["product"]
     user_id = message.from_user.id
 
     await add_to_cart(user_id, product_id, quantity)
-    keyboard = InlineKeyboardMarkup(row_width=1).add(
-        InlineKeyboardButton("🛒 Посмотреть корзину", callback_data="view_cart"),
-        InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-    )
     await message.answer(
-        f"Добавлено в корзину: {product[1]} - {quantity} шт.",
-        reply_markup=keyboard
+        f"Добавлено в корзину: {data['product_name']} - {quantity} шт.",
+        reply_markup=added_to_cart
     )
     await state.finish()
 
-@dp.callback_query_handler(lambda c: c.data == "view_cart")
+@router.handler(callbacks.VIEW_CART)
 async def view_cart(call: CallbackQuery):
+    await call.answer()
     user_id = call.from_user.id
-    cart_items = await get_cart(user_id)
-    await call.message.delete()
-
-    if not cart_items:
-        await call.message.answer(
-            "🛒 Ваша корзина пуста!",
-            reply_markup=InlineKeyboardMarkup().add(
-                InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-            )
-        )
-        await call.answer()
+    cart = await get_cart_summary(user_id)
+
+    if not cart.lines:
+        await show_screen(call.message, "🛒 Ваша корзина пуста!", reply_markup=main_menu)
         return
 
-    text = "🛒 Ваша корзина:\n\n"
-    for idx, item in enumerate(cart_items, 1):
-        text += f"{idx}. {item[1]} - {item[3]} сом x {item[6]} шт.\n"
+    text = "🛒 Ваша корзина:\n\n" + "".join(
+        f"{idx}. {line.name} - {line.price} сом x {line.quantity} шт.\n" for idx, line in enumerate(cart.lines, 1)
+    ) + f"\n💰 Итого: {cart.total} сом ({cart.count} шт.)"
 
-    keyboard = InlineKeyboardMarkup(row_width=2).add(
-        InlineKeyboardButton("✅ Оформить заказ", callback_data="checkout"),
-        InlineKeyboardButton("🗑 Очистить корзину", callback_data="clear_cart"),
-        InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-    )
-    await call.message.answer(text, reply_markup=keyboard)
-    await call.answer()
+    await show_screen(call.message, text, reply_markup=cart_keyboard)
 
-@dp.callback_query_handler(lambda c: c.data == "clear_cart")
+@router.handler(callbacks.CLEAR_CART)
 async def clear_cart_handler(call: CallbackQuery):
+    await call.answer()
     user_id = call.from_user.id
     await clear_cart(user_id)
-    await call.message.delete()
-    await call.message.answer(
-        "🛒 Корзина очищена!",
-        reply_markup=InlineKeyboardMarkup().add(
-            InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-        )
-    )
-    await call.answer()
+    await show_screen(call.message, "🛒 Корзина очищена!", reply_markup=main_menu)
 
 # ---------------- Purchase Process Handlers ----------------
-@dp.callback_query_handler(lambda c: c.data == "checkout")
+@router.handler(callbacks.CHECKOUT)
 async def checkout(call: CallbackQuery, state: FSMContext):
+    await call.answer()
     user_id = call.from_user.id
-    cart_items = await get_cart(user_id)
-    if not cart_items:
-        await call.message.delete()
-        await call.message.answer(
-            "🛒 Корзина пуста!",
-            reply_markup=InlineKeyboardMarkup().add(
-                InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-            )
-        )
-        await call.answer()
+    # Usually still cached from view_cart
+    cart = await get_cart_summary(user_id)
+    if not cart.lines:
+        await show_screen(call.message, "🛒 Корзина пуста!", reply_markup=main_menu)
         return
 
-    await state.update_data(cart_items=cart_items)
-    keyboard = InlineKeyboardMarkup().add(
-        InlineKeyboardButton("❌ Отмена", callback_data="cancel_purchase")
-    )
-    await call.message.delete()
-    new_message = await call.message.answer("Пожалуйста, укажите ваше имя:", reply_markup=keyboard)
+    new_message = await show_screen(call.message, "Пожалуйста, укажите ваше имя:", reply_markup=cancel_purchase_keyboard)
     await PurchaseState.waiting_for_name.set()
     await state.update_data(msg1=new_message.message_id)
-    await call.answer()
 
 @dp.message_handler(state=PurchaseState.waiting_for_name, content_types=types.ContentTypes.TEXT)
 async def process_name(message: types.Message, state: FSMContext):
@@ -337,10 +243,7 @@ async def process_name(message: types.Message, state: FSMContext):
     data = await state.get_data()
     msg1 = data["msg1"]
     await bot.edit_message_reply_markup(chat_id=message.chat.id, message_id=msg1, reply_markup=None)
-    keyboard = InlineKeyboardMarkup().add(
-        InlineKeyboardButton("❌ Отмена", callback_data="cancel_purchase")
-    )
-    new_message = await message.answer("Пожалуйста, укажите ваш номер телефона:", reply_markup=keyboard)
+    new_message = await message.answer("Пожалуйста, укажите ваш номер телефона:", reply_markup=cancel_purchase_keyboard)
     await PurchaseState.waiting_for_phone.set()
     await state.update_data(msg2=new_message.message_id)
 
@@ -353,46 +256,46 @@ async def process_phone(message: types.Message, state: FSMContext):
 
     await state.update_data(phone=phone)
     data = await state.get_data()
-    cart_items = data["cart_items"]
+    cart = await get_cart_summary(message.from_user.id)
     msg2 = data["msg2"]
     await bot.edit_message_reply_markup(chat_id=message.chat.id, message_id=msg2)
 
-    order_message = "📩 *Новый заказ!*\n\n"
-    for idx, item in enumerate(cart_items, 1):
-        order_message += f"{idx}. *Товар:* {item[1]} - {item[3]} сом x {item[6]} шт.\n"
-    order_message += (
+    if not cart.lines:
+        await message.answer(
+            "🛒 Корзина пуста!",
+            reply_markup=main_menu
+        )
+        await state.finish()
+        return
+
+    order_message = "📩 *Новый заказ!*\n\n" + "".join(
+        f"{idx}. *Товар:* {line.name} - {line.price} сом x {line.quantity} шт.\n" for idx, line in enumerate(cart.lines, 1)
+    ) + (
+        f"💰 *Итого:* {cart.total} сом\n"
         f"👤 *Имя:* {data['name']}\n"
         f"📞 *Телефон:* {phone}\n"
         f"🏷 *Username:* @{message.from_user.username or 'Не указан'}\n"
         f"🆔 *ID:* {message.from_user.id}"
     )
 
-    for admin in ADMINS:
-        try:
-            await bot.send_message(admin, order_message, parse_mode=types.ParseMode.MARKDOWN)
-        except:
-            pass
+    # Saved with the order and delivered to admins by core.outbox, retried until it goes through
+    await create_order(
+        message.from_user.id, data['name'], phone, message.from_user.username, cart,
+        [(admin, order_message, types.ParseMode.MARKDOWN) for admin in ADMINS]
+    )
+    wake_outbox()
 
-    await clear_cart(message.from_user.id)
     await message.answer(
         "Спасибо за заказ! Мы свяжемся с вами в ближайшее время.",
-        reply_markup=InlineKeyboardMarkup().add(
-            InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-        )
+        reply_markup=main_menu
     )
     await state.finish()
 
-@dp.callback_query_handler(lambda c: c.data == "cancel_purchase", state='*')
+@router.handler(callbacks.CANCEL_PURCHASE, state='*')
 async def cancel_purchase(call: CallbackQuery, state: FSMContext):
-    await state.finish()
-    await call.message.edit_reply_markup()
-    await call.message.answer(
-        "Операция отменена.",
-        reply_markup=InlineKeyboardMarkup().add(
-            InlineKeyboardButton("🏠 Главное меню", callback_data="menu")
-        )
-    )
     await call.answer()
+    await state.finish()
+    await show_screen(call.message, "Операция отменена.", reply_markup=main_menu)
 
 # ---------------- Input Validation Handlers ----------------
 @dp.message_handler(state=QuantityState.waiting_for_quantity, content_types=types.ContentTypes.ANY)
@@ -1,6 +1,6 @@
 from aiogram import types
 from aiogram.dispatcher import FSMContext
-from core.db import add_user, user_exists
+from core.db import register_user
 from core.keyboards import start
 from loader import dp, bot
 
@@ -12,8 +12,7 @@ async def start_command(message: types.Message, state: FSMContext):
     name = message.from_user.full_name
     username = message.from_user.username
 
-    if not await user_exists(user_id):
-        await add_user(user_id, name, username)
+    await register_user(user_id, name, username)  # no query for returning users
 
     await message.answer("Добро пожаловать в бот! Нажмите кнопку ниже, чтобы увидеть наши доступные продукты.", reply_markup=start)
 
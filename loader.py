@@ -1,7 +1,11 @@
-from aiogram import Bot, Dispatcher
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram import Dispatcher
 from config import BOT_TOKEN
+from core import metrics, callbacks
+from core.bot import ShopBot
+from core.storage import SQLiteStorage
 
-# Initialize bot, dispatcher, and memory storage
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(bot, storage=MemoryStorage())
+# Initialize bot, dispatcher, and persistent FSM storage
+bot = ShopBot(token=BOT_TOKEN)
+dp = Dispatcher(bot, storage=SQLiteStorage())
+metrics.setup(dp)
+callbacks.router.setup(dp)
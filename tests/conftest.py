@@ -0,0 +1,34 @@
+import aiosqlite
+import pytest
+
+from bench import fakeapi
+
+
+# The bot against the stand-in Bot API and a database of its own; every swap is undone afterwards
+@pytest.fixture
+def fake_bot(tmp_path, monkeypatch):
+    fakeapi.install(database=None, path=str(tmp_path / "bot.db"), setattr=monkeypatch.setattr)
+    from loader import dp, bot
+    import handlers  # noqa: F401 registers handlers
+    return dp, bot
+
+
+# (sql, params) of every statement sent from here on. Same hook as bench/e2e.py: every execute
+# and executemany passes through Connection._execute
+@pytest.fixture
+def statements(monkeypatch):
+    recorded = []
+    execute = aiosqlite.Connection._execute
+
+    async def recording(self, fn, *args, **kwargs):
+        if fn.__name__ in ("execute", "executemany") and args:
+            sql, params = args[0], args[1] if len(args) > 1 else ()
+            if fn.__name__ == "executemany":
+                params = list(params)
+                args = (sql, params)
+                params = params[0] if params else ()
+            recorded.append((" ".join(sql.split()), tuple(params)))
+        return await execute(self, fn, *args, **kwargs)
+
+    monkeypatch.setattr(aiosqlite.Connection, "_execute", recording)
+    return recorded
@@ -0,0 +1,66 @@
+# Round trips to the Bot API per button press, counted by core.metrics the same way as in
+# production: the answer to the callback rides in the webhook response, so browsing a screen
+# must cost at most the one edit that redraws it.
+# Run from the repo root: python -m pytest
+import asyncio
+
+from bench import fakeapi
+
+USER_ID = 42
+# (callback data, whether the pressed message is a photo), each redrawing the screen it was pressed on
+NAVIGATION = (
+    ("menu", False),
+    ("about", False),
+    ("products", False),
+    ("category_phones", True),
+    ("phone_next_{phone}", True),
+    ("phone_prev_{next_phone}", True),
+    ("category_accessories", True),
+    ("view_cart", False),
+    ("menu", False),
+)
+
+
+async def _press(dp, update_id, data, photo):
+    from aiogram import types
+    from core import metrics
+    from core.bot import WebhookReply, webhook_reply
+
+    update = types.Update(**fakeapi.callback_update(update_id, USER_ID, data, photo))
+    reply = WebhookReply(update.callback_query.id)
+    token = webhook_reply.set(reply)
+    before = sum(metrics.api_requests.totals.values())
+    try:
+        await dp.process_update(update)
+    finally:
+        webhook_reply.reset(token)
+    return sum(metrics.api_requests.totals.values()) - before, reply.method
+
+
+async def _browse(dp, bot):
+    from aiogram import Bot, Dispatcher
+    import app as bot_app
+    from core import db
+
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await bot_app.on_startup(dp)
+    try:
+        await db.add_products([(f"Phone {i}", "d", 100, "Smartphones", "file-id") for i in range(3)]
+                              + [(f"Case {i}", "d", 10, "Accessories", "file-id") for i in range(3)])
+        phones = (await db.get_catalog()).categories["Smartphones"]
+        await db.register_user(USER_ID, "User", None)
+        results = []
+        for update_id, (data, photo) in enumerate(NAVIGATION, 1):
+            data = data.format(phone=phones[0], next_phone=phones[1])
+            results.append((data, *await _press(dp, update_id, data, photo)))
+        return results
+    finally:
+        await bot_app.on_shutdown(dp)
+        await (await bot.get_session()).close()
+
+
+def test_navigation_costs_one_request_per_press(fake_bot):
+    for data, requests, answered_with in asyncio.run(_browse(*fake_bot)):
+        assert answered_with == "answerCallbackQuery", data
+        assert requests <= 1, f"{data}: {requests} Bot API requests"
@@ -0,0 +1,70 @@
+# Callback data codec and prefix trie: new() and parse() are exact inverses, and resolve() picks
+# the right callback when prefixes overlap.
+# Run from the repo root: python -m pytest
+import pytest
+
+from core import callbacks
+from core.callbacks import Callback, CallbackRouter
+
+
+async def _handler(call, **fields):
+    pass
+
+
+@pytest.fixture
+def router():
+    router = CallbackRouter()
+    for callback in (callbacks.SEARCH, callbacks.SEARCH_PAGE, callbacks.ADMIN_CATEGORY,
+                     callbacks.CATEGORY_PHONES, callbacks.CATEGORY_ACCESSORIES, callbacks.ADD_TO_CART,
+                     callbacks.PHONE_NEXT, callbacks.SEE_USERS, callbacks.MENU):
+        router.register(_handler, callback)
+    return router
+
+
+@pytest.mark.parametrize("callback, values, fields", [
+    (callbacks.MENU, (), {}),
+    (callbacks.ADD_TO_CART, (123,), {"product_id": 123}),
+    (callbacks.PHONE_NEXT, (-7,), {"product_id": -7}),
+    (callbacks.SEARCH_PAGE, ("ab12cd34", 5), {"token": "ab12cd34", "index": 5}),
+    (callbacks.ADMIN_CATEGORY, ("smart_phone",), {"category": "smart_phone"}),
+    (callbacks.SEE_USERS, (0,), {"page": 0, "direction": "a", "row_id": 0}),
+    (callbacks.SEE_USERS, (3, "b", 41), {"page": 3, "direction": "b", "row_id": 41}),
+])
+def test_new_and_parse_round_trip(router, callback, values, fields):
+    assert router.resolve(callback.new(*values)) == (callback, fields)
+
+
+@pytest.mark.parametrize("data", [
+    "add_to_cart_12_3", "add_to_cart_+5", "add_to_cart_ 5", "add_to_cart_5 ", "add_to_cart_",
+    "add_to_cart_٣", "add_to_cart_007", "add_to_cart_-0",  # int() takes all of these
+    "see_users:0:", "see_users:1:a5", "see_users:1:c:5", "see_users:1:a:x",
+    "search_ab12cd34", "search_ab12cd34_", "search__1", "cat_", "menu_1", "unknown",
+])
+def test_resolve_rejects_data_new_never_writes(router, data):
+    assert router.resolve(data) is None
+
+
+def test_resolve_overlapping_prefixes(router):
+    assert router.resolve("search") == (callbacks.SEARCH, {})
+    assert router.resolve("search_ab12cd34_2") == (callbacks.SEARCH_PAGE, {"token": "ab12cd34", "index": 2})
+    assert router.resolve("cat_accessories") == (callbacks.ADMIN_CATEGORY, {"category": "accessories"})
+    assert router.resolve("category_phones") == (callbacks.CATEGORY_PHONES, {})
+    assert router.resolve("category_accessories") == (callbacks.CATEGORY_ACCESSORIES, {})
+    assert router.resolve("category_tablets") is None
+
+
+@pytest.mark.parametrize("callback, values", [
+    (callbacks.SEARCH_PAGE, ("ab_cd", 1)),  # holds the separator
+    (callbacks.SEARCH_PAGE, ("", 1)),
+    (callbacks.SEE_USERS, (1, "c", 5)),
+    (callbacks.ADD_TO_CART, ("+5",)),
+    (callbacks.ADMIN_CATEGORY, ("x" * 64,)),
+])
+def test_new_refuses_data_that_would_not_parse_back(callback, values):
+    with pytest.raises(ValueError):
+        callback.new(*values)
+
+
+def test_register_refuses_taken_prefix(router):
+    with pytest.raises(ValueError):
+        router.register(_handler, Callback("add_to_cart", ("index", int)))
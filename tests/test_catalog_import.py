@@ -0,0 +1,87 @@
+# Bulk catalog import: what is rejected, what is reported, and what actually reaches the products table.
+# Run from the repo root: python -m pytest
+import asyncio
+import sqlite3
+
+import pytest
+
+from core import catalog_io, db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db.pool, "path", str(tmp_path / "bot.db"))
+    asyncio.run(db.init_db())
+    return db.pool.path
+
+
+def _import(path):
+    async def run():
+        try:
+            return await catalog_io.import_catalog(str(path))
+        finally:
+            await db.on_shutdown()
+    return asyncio.run(run())
+
+
+def _products(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT name, description, price, category, image FROM products ORDER BY id").fetchall()
+
+
+def test_csv_rejects_bad_prices_and_categories(database, tmp_path):
+    path = tmp_path / "catalog.csv"
+    path.write_text(
+        "name,description,price,category,image\n"
+        "Phone,Good,\"1 200,50\",smartphones,file-1\n"
+        "NaN,d,nan,smartphones,file-2\n"
+        "Inf,d,inf,smartphones,file-3\n"
+        "Huge,d,1e309,smartphones,file-4\n"
+        "Negative,d,-5,accessories,file-5\n"
+        "Tablet,d,100,tablets,file-6\n"
+        "Case,,10,Аксессуары,file-7\n",
+        encoding="utf-8",
+    )
+    report = _import(path)
+    assert (report.added, report.rejected) == (2, 5)
+    assert report.errors == [
+        "3: неверная цена 'nan'", "4: неверная цена 'inf'", "5: неверная цена '1e309'",
+        "6: отрицательная цена", "7: неизвестная категория 'tablets'",
+    ]
+    assert _products(database) == [
+        ("Phone", "Good", 1200.5, "Smartphones", "file-1"),
+        ("Case", "", 10.0, "Accessories", "file-7"),
+    ]
+
+
+def test_jsonl_keeps_importing_after_a_bad_line(database, tmp_path):
+    path = tmp_path / "catalog.jsonl"
+    path.write_text(
+        '{"name": "Phone", "price": 100, "category": "smartphone", "image": "file-1"}\n'
+        '{"name": "Broken", "price": 1\n'
+        '\n'
+        '{"name": "Case", "price": "9,5", "category": "accessory", "image": "file-2"}\n'
+        '{"name": "NaN", "price": NaN, "category": "accessory", "image": "file-3"}\n',
+        encoding="utf-8",
+    )
+    report = _import(path)
+    assert (report.added, report.rejected) == (2, 2)
+    assert report.errors[0].startswith("2: неверный JSON")
+    assert report.errors[1] == "5: неверная цена nan"
+    assert [row[0] for row in _products(database)] == ["Phone", "Case"]
+    assert _products(database)[1][2] == 9.5
+
+
+def test_truncated_json_array_keeps_the_rows_before_it(database, tmp_path):
+    path = tmp_path / "catalog.json"
+    path.write_text(
+        '[{"name": "Phone", "price": 100, "category": "smartphones", "image": "file-1"},\n'
+        ' {"name": "Inf", "price": Infinity, "category": "smartphones", "image": "file-2"},\n'
+        ' {"name": "Case", "price": 10, "category": "accessories", "ima',
+        encoding="utf-8",
+    )
+    report = _import(path)
+    assert (report.added, report.rejected) == (1, 2)
+    assert report.errors[0] == "2: неверная цена inf"
+    assert report.errors[1].startswith("файл: ")
+    assert _products(database) == [("Phone", "", 100.0, "Smartphones", "file-1")]
@@ -0,0 +1,112 @@
+# Every statement core.db sends on a hot path must find its rows through an index. The statements
+# are recorded while the real functions run, then explained, so the check follows the code.
+# Run from the repo root: python -m pytest
+import asyncio
+import logging
+import re
+import sqlite3
+import time
+
+import pytest
+
+from core import db
+
+# Reads that want every row by design or run once at startup, matched by a fragment of their SQL
+FULL_SCANS = (
+    "FROM products ORDER BY id",  # catalog snapshot
+    "FROM users WHERE blocked = 0",  # known users at startup, broadcast recipients
+    "FROM broadcasts WHERE finished = 0",  # resuming broadcasts at startup, a handful of rows
+    "MATCH",  # FTS5 picks its own index; its plan shows as a virtual table scan
+)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db.pool, "path", str(tmp_path / "bot.db"))
+    asyncio.run(db.init_db())
+    return db.pool.path
+
+
+def _schema(path):
+    with sqlite3.connect(path) as conn:
+        return (
+            conn.execute("PRAGMA user_version").fetchone()[0],
+            conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall(),
+            conn.execute("SELECT * FROM counters ORDER BY name").fetchall(),
+            conn.execute("SELECT * FROM stats_hourly ORDER BY metric, hour").fetchall(),
+        )
+
+
+def test_migrations_reach_latest_version_once(database, caplog):
+    before = _schema(database)
+    assert before[0] == len(db.MIGRATIONS)
+    with caplog.at_level(logging.INFO):
+        asyncio.run(db.init_db())
+    assert _schema(database) == before
+    assert "Applied database migration" not in caplog.text
+
+
+async def _hot_paths():
+    await db.on_startup()
+    try:
+        await db.add_products([
+            (f"Phone {i}", "d", 100 + i, "Smartphones", "https://example.com/p.jpg") for i in range(20)
+        ] + [(f"Case {i}", "d", 10, "Accessories", "file-id") for i in range(5)])
+        await db.reload_catalog()
+        for user_id in range(1, 6):
+            await db.register_user(user_id, f"User {user_id}", None)
+
+        await db.add_to_cart(1, 1, 2)
+        await db.add_to_cart_many(1, [(2, 1), (3, 1)])
+        cart = await db.get_cart_summary(1)
+        await db.create_order(1, "User 1", "+996", None, cart, [(1000, "order", None)])
+        await db.add_to_cart(2, 4)
+        await db.clear_cart(2)
+
+        outbox = await db.get_due_outbox(time.time() + 1, 10)
+        await db.retry_outbox(outbox[0][0], time.time())
+        await db.delete_outbox(outbox[0][0])
+
+        await db.search_product_ids("phone", 10)
+        async for _ in db.iter_products(10):
+            pass
+        await db.get_products_with_image_urls()
+        await db.set_product_images([(5, "file-id")])
+        await db.delete_product(25)
+
+        await db.count_users()
+        await db.count_new_users_last_24_hours()
+        await db.get_stats_trend(7)
+        await db.get_all_users(after_id=2)
+        await db.get_all_users(before_id=4)
+
+        broadcast_id = await db.create_broadcast(1000, 1, 1000)
+        await db.set_broadcast_progress_message(broadcast_id, 2)
+        await db.get_broadcast(broadcast_id)
+        await db.get_unfinished_broadcast_ids()
+        users = await db.get_pending_broadcast_users(broadcast_id, 10)
+        await db.save_broadcast_results(broadcast_id, [(user_id, "sent") for user_id in users[:-1]]
+                                        + [(users[-1], "blocked")])
+        await db.get_broadcast_counts(broadcast_id)
+        await db.finish_broadcast(broadcast_id)
+    finally:
+        await db.on_shutdown()
+
+
+def test_hot_queries_use_indexes(database, statements):
+    asyncio.run(_hot_paths())
+
+    explained = 0
+    with sqlite3.connect(database) as conn:
+        for sql, params in dict.fromkeys(statements):
+            if not sql.startswith(("SELECT", "UPDATE", "DELETE", "INSERT")):
+                continue
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            if not plan or any(fragment in sql for fragment in FULL_SCANS):
+                continue  # plain INSERT ... VALUES has nothing to plan
+            explained += 1
+            # "SCAN (subquery-1)" walks rows already found, only a named table is a table scan
+            scans = [step for step in plan if re.match(r"SCAN \w", step)]
+            assert not scans, f"{sql}\n  plans as {plan}"
+            assert any(step.startswith("SEARCH") for step in plan), f"{sql}\n  plans as {plan}"
+    assert explained >= 20
@@ -0,0 +1,43 @@
+# /start from a returning user: register_user answers from the known-user set and state.finish()
+# finds nothing to clear, so the whole update must stay off the single writer.
+# Run from the repo root: python -m pytest
+import asyncio
+
+from bench import fakeapi
+
+USER_ID = 42
+WRITES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+async def _start_twice(dp, bot, statements):
+    from aiogram import Bot, Dispatcher, types
+    import app as bot_app
+
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await bot_app.on_startup(dp)
+    try:
+        await dp.process_update(types.Update(**fakeapi.message_update(1, USER_ID, "/start")))
+        first = list(statements)
+        statements.clear()
+        await dp.process_update(types.Update(**fakeapi.message_update(2, USER_ID, "/start")))
+        return first, list(statements)
+    finally:
+        await bot_app.on_shutdown(dp)
+        await (await bot.get_session()).close()
+
+
+def _touching(statements, table):
+    return [sql for sql, _ in statements if f" {table} " in f" {sql} "]
+
+
+def test_repeat_start_skips_users_table(fake_bot, statements):
+    first, repeat = asyncio.run(_start_twice(*fake_bot, statements))
+    assert any(sql.startswith("INSERT INTO users") for sql in _touching(first, "users"))
+    assert not _touching(repeat, "users"), repeat
+
+
+def test_repeat_start_without_state_writes_nothing(fake_bot, statements):
+    _, repeat = asyncio.run(_start_twice(*fake_bot, statements))
+    writes = [sql for sql, _ in repeat if sql.startswith(WRITES)]
+    assert not writes, writes
@@ -0,0 +1,33 @@
+# FSM state in SQLite: what state.finish() keeps and when a row goes away.
+# Run from the repo root: python -m pytest
+import asyncio
+import sqlite3
+
+USER_ID = 42
+
+
+def _rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT chat_id, user_id, state, data, bucket FROM fsm_states").fetchall()
+
+
+async def _finish_keeps_bucket(storage):
+    from core import db
+    await db.init_db()
+    try:
+        await storage.set_state(user=USER_ID, state="Checkout:phone")
+        await storage.update_data(user=USER_ID, name="User")
+        await storage.set_bucket(user=USER_ID, bucket={"hits": 1})
+        await storage.reset_state(user=USER_ID)
+        after_finish = _rows(db.pool.path)
+        await storage.set_bucket(user=USER_ID, bucket=None)
+        return after_finish, _rows(db.pool.path)
+    finally:
+        await db.on_shutdown()
+
+
+def test_finish_keeps_bucket_and_drops_empty_rows(fake_bot):
+    dp, _ = fake_bot
+    after_finish, after_bucket = asyncio.run(_finish_keeps_bucket(dp.storage))
+    assert after_finish == [(USER_ID, USER_ID, None, None, '{"hits":1}')]
+    assert after_bucket == []